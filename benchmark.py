@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Medição de desempenho do rasterizador paralelo por tiles.
+
+Renderiza os exemplos 3D de docs/exemplos.json sem janela, variando a quantidade de
+threads (ou processos), e imprime o tempo médio por quadro e o ganho sobre o modo serial.
+
+Uso:
+    python3 benchmark.py [-t 1 2 4 8] [-f 3] [--processos] [exemplo ...]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import io
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "renderizador"))
+
+import gl           # pylint: disable=wrong-import-position
+import gpu          # pylint: disable=wrong-import-position
+import x3d          # pylint: disable=wrong-import-position
+import renderizador # pylint: disable=wrong-import-position
+
+DIR = "docs/exemplos/"
+
+
+def exemplos_3d(nomes):
+    """Lista (nome, arquivo, largura, altura) dos exemplos 3D."""
+    with open('docs/exemplos.json', 'r') as f:
+        data = json.load(f)
+
+    exemplos = []
+    for section in data['examples']:
+        for example in section['examples']:
+            if not example['path'].startswith("3D"):
+                continue
+            if nomes and example['x3d'] not in nomes:
+                continue
+            arquivo = os.path.join(DIR, example['path'], example['x3d'], example['x3d'] + ".x3d")
+            exemplos.append((example['x3d'], arquivo,
+                             example.get('width', 640), example.get('height', 480)))
+    return exemplos
+
+
+def medir(arquivo, largura, altura, quadros):
+    """Renderiza a cena e retorna o tempo médio por quadro (o primeiro quadro é descartado)."""
+    r = renderizador.Renderizador()
+    r.width, r.height, r.x3d_file = largura, altura, arquivo
+    x3d.X3DNode.named_nodes = {}
+
+    gpu.GPU(r.image_file, os.path.dirname(os.path.abspath(arquivo)))
+    r.scene = x3d.X3D(arquivo)
+    gl.GL.setup(largura, altura, near=0.01, far=1000)
+    r.mapping()
+    r.scene.parse()
+    r.setup()
+
+    with contextlib.redirect_stdout(io.StringIO()):  # as rotinas imprimem no terminal
+        r.render()
+        inicio = time.perf_counter()
+        for _ in range(quadros):
+            r.render()
+    return (time.perf_counter() - inicio) / quadros
+
+
+def coluna(tempo, serial):
+    """Formata o tempo por quadro e o ganho sobre o modo serial."""
+    return f"{tempo*1000:9.1f}ms {serial/tempo:4.1f}x"
+
+
+def main():
+    """Executa as medições."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("exemplos", nargs="*", help="nomes dos exemplos (padrão: todos 3D)")
+    parser.add_argument("-t", "--threads", nargs="+", type=int, default=[1, 2, 4, 8],
+                        help="quantidades de threads (ou processos) a medir")
+    parser.add_argument("-f", "--frames", type=int, default=3, help="quadros medidos por cena")
+    parser.add_argument("-s", "--scale", type=int, default=1,
+                        help="multiplica a resolução dos exemplos")
+    parser.add_argument("--processos", action="store_true",
+                        help="usa processos (multiprocessing) em vez de threads")
+    args = parser.parse_args()
+
+    contagens = [0] + [n for n in args.threads if n > 0]
+    print(f"{'exemplo':15}" + "".join(f"{n:>16}" for n in contagens))
+
+    totais = [0.0] * len(contagens)
+    for nome, arquivo, largura, altura in exemplos_3d(args.exemplos):
+        tempos = []
+        for n in contagens:
+            gl.GL.workers = n if args.processos else 0
+            gl.GL.threads = 0 if args.processos else n
+            tempos.append(medir(arquivo, largura * args.scale, altura * args.scale, args.frames))
+
+        for i, tempo in enumerate(tempos):
+            totais[i] += tempo
+        print(f"{nome:15}" + "".join(coluna(t, tempos[0]) for t in tempos))
+
+    print(f"{'total':15}" + "".join(coluna(t, totais[0]) for t in totais))
+    gl.GL.workers = gl.GL.threads = 0
+    gl.GL.setup(1, 1)  # encerra os processos/threads
+
+
+if __name__ == '__main__':
+    main()
@@ -12,12 +12,17 @@ Data: <10/08/2024>
 """
 
 import time         # Para operações com tempo
+import atexit       # Para encerrar os processos do modo paralelo
 import gpu          # Simula os recursos de uma GPU
+import x3d          # Triangulação das malhas do X3D
 import math         # Funções matemáticas
 import numpy as np  # Biblioteca do Numpy
+from collections import OrderedDict  # Para o cache LRU das malhas
 from PIL import Image
 
 from texture import TextureHandler
+from lighting import Lighting
+from rasterizer import Rasterizer, TilePool, TileThreadPool
 
 class GL:
     """Classe que representa a biblioteca gráfica (Graphics Library)."""
@@ -28,7 +33,38 @@ class GL:
     far = 1000    # plano de corte distante
     sampling = 2
 
-    rad_step = 12
+    rad_step = 12  # segmentos de uma volta nas primitivas (máximo do nível de detalhe)
+    min_segments = 4  # mínimo de segmentos de uma volta para primitivas pequenas na tela
+    lod_error = 0.5  # distância máxima (em pixels super amostrados) da malha à superfície
+
+    rasterizer = "vectorized"  # "scalar" (pixel a pixel) ou "vectorized" (Numpy)
+    tile_size = 32  # lado dos tiles em pixels super amostrados (0 desliga o binning)
+    workers = 0  # processos rasterizando os tiles em paralelo (0 desenha no próprio processo)
+    threads = 0  # threads rasterizando os tiles em paralelo (usado quando workers é 0)
+
+    inside_depth = 0  # profundidade do Transform que está todo dentro do volume de visão
+    tile_pool = None  # processos ou threads do modo paralelo
+    draw_queue = []  # triângulos aguardando os processos do modo paralelo
+
+    tessellations = OrderedDict()  # malhas das primitivas (Sphere, Cone, Cylinder, Box)
+    max_tessellations = 256  # quantidade máxima de malhas guardadas
+
+    lights = []  # luzes do quadro atual, no sistema de coordenadas da câmera
+    shading = "gouraud"  # "gouraud" (por vértice), "phong" (por fragmento) ou "deferred"
+
+    gbuffer = None  # posição do FrameBuffer do G-buffer na GPU (modo deferred)
+    materials = []  # materiais iluminados do quadro (o índice 0 do G-buffer é sem iluminação)
+    material_index = {}  # valores do material -> índice no G-buffer
+    forward_queue = []  # transparentes, desenhados depois da iluminação no modo deferred
+    light_tiles = None  # luzes que alcançam cada tile (calculado uma vez por quadro)
+
+    fog_range = 0  # visibilityRange do Fog (0 desliga a névoa)
+    fog_color = [1.0, 1.0, 1.0]  # cor da névoa
+    fog_type = "LINEAR"  # "LINEAR" ou "EXPONENTIAL"
+
+    # Contadores do quadro atual
+    stats = {"culled_triangles": 0, "culled_transforms": 0, "lights_per_tile": 0,
+             "fogged_triangles": 0}
 
     @staticmethod
     def setup(width, height, near=0.01, far=1000):
@@ -42,10 +78,67 @@ class GL:
         GL.perspective_matrix = np.identity(4)
         
         GL.transformation_stack = [np.identity(4)]
+        GL.lights = []
+        GL.light_tiles = None
+        GL.fog_range = 0
+
+        # No modo paralelo com processos os buffers super amostrados ficam em memória
+        # compartilhada; com threads basta que cada thread desenhe tiles diferentes
+        GL._stop_workers()
+        if GL.tile_size and GL.rasterizer == "vectorized":
+            if GL.workers:
+                GL.tile_pool = TilePool(GL.workers, GL.height * GL.sampling, GL.width * GL.sampling)
+                atexit.register(GL._stop_workers)
+            elif GL.threads:
+                GL.tile_pool = TileThreadPool(GL.threads, GL.height * GL.sampling,
+                                              GL.width * GL.sampling)
+
+        if GL.tile_pool:
+            GL.sample_frame_buffer = GL.tile_pool.color_buffer
+            GL.z_buffer = GL.tile_pool.z_buffer
+            GL.clear_sample_buffers()
+        else:
+            GL.sample_frame_buffer = np.zeros((GL.sampling * GL.height, GL.sampling * GL.width, 3), dtype=np.uint8)
+
+            GL.z_buffer = np.full((GL.height * GL.sampling, GL.width * GL.sampling), np.inf)
+
+        # Modo deferred: os triângulos iluminados gravam normal, cor difusa e material no
+        # G-buffer e a iluminação é calculada uma única vez por pixel visível no fim do
+        # quadro. Só no rasterizador vetorizado sem processos ou threads (senão fica phong).
+        GL.gbuffer = None
+        if GL.shading == "deferred" and GL.rasterizer == "vectorized" and not GL.tile_pool:
+            GL._setupGBuffer()
+
+        # Matriz que leva as coordenadas normalizadas para a tela super amostrada
+        high_res_width = GL.width * GL.sampling
+        high_res_height = GL.height * GL.sampling
+        GL.mapping_matrix = np.array([
+            [high_res_width / 2, 0, 0, high_res_width / 2],
+            [0, -high_res_height / 2, 0, high_res_height / 2],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1]
+        ])
 
-        GL.sample_frame_buffer = np.zeros((GL.sampling * GL.height, GL.sampling * GL.width, 3), dtype=np.uint8)
-        
-        GL.z_buffer = np.full((GL.height * GL.sampling, GL.width * GL.sampling), np.inf)
+    @staticmethod
+    def _setupGBuffer():
+        """Aloca na GPU o G-buffer (na resolução super amostrada) do modo deferred."""
+        width = GL.width * GL.sampling
+        height = GL.height * GL.sampling
+
+        # A profundidade do G-buffer é o próprio z-buffer do rasterizador (float64): com
+        # DEPTH_COMPONENT32F os empates do teste de profundidade mudariam a imagem
+        GL.gbuffer = gpu.GPU.gen_framebuffers(1)[0]
+        for attachment, mode in ((gpu.GPU.NORMAL_ATTACHMENT, gpu.GPU.RGB32F),
+                                 (gpu.GPU.ALBEDO_ATTACHMENT, gpu.GPU.RGB32F),
+                                 (gpu.GPU.MATERIAL_ATTACHMENT, gpu.GPU.R16UI)):
+            gpu.GPU.framebuffer_storage(GL.gbuffer, attachment, mode, width, height)
+
+    @staticmethod
+    def _gbufferAttachments():
+        """Normal, cor difusa e índice do material de cada amostra do G-buffer."""
+        return (gpu.GPU.get_attachment(GL.gbuffer, gpu.GPU.NORMAL_ATTACHMENT),
+                gpu.GPU.get_attachment(GL.gbuffer, gpu.GPU.ALBEDO_ATTACHMENT),
+                gpu.GPU.get_attachment(GL.gbuffer, gpu.GPU.MATERIAL_ATTACHMENT)[:, :, 0])
 
     @staticmethod
     def polypoint2D(point, colors):
@@ -173,8 +266,63 @@ class GL:
     def _drawTriangles(
                     points, colors=None,
                     colorPerVertex=False, vertexColors=None,
-                    texPerVertex=False, vertexTex=None, texture=None
+                    texPerVertex=False, vertexTex=None, texture=None, mipmaps=None,
+                    vertexNormals=None, vertexPositions=None, material=0
+                ):
+        """Rasteriza os triângulos no framebuffer super amostrado com o rasterizador escolhido."""
+        # Se os mipmaps da textura já forem conhecidos (cache da GPU) eles não são gerados.
+        # No modo deferred material é o índice gravado no G-buffer (None não usa o G-buffer).
+
+        # No modo paralelo os triângulos ficam na fila e são desenhados pelos processos (ou
+        # threads) no final do quadro (GL.flush)
+        if GL.tile_pool:
+            texPerVertex = texPerVertex and not colorPerVertex
+            GL.draw_queue.append({
+                "points": np.asarray(points, dtype=np.float64),
+                "colors": colors,
+                "vertexColors": np.asarray(vertexColors, dtype=np.float64) if colorPerVertex else None,
+                "vertexTex": np.asarray(vertexTex, dtype=np.float64) if texPerVertex else None,
+                "texture": texture if texPerVertex else None,
+                "mipmaps": mipmaps if texPerVertex else None,
+                "vertexNormals": vertexNormals,
+                "vertexPositions": vertexPositions,
+                "lights": GL.lights,
+                "light_tiles": GL._lightTiles() if vertexPositions is not None else None,
+            })
+            return
+
+        if texPerVertex:
+            if mipmaps is None:
+                mipmaps = TextureHandler.generate_mipmaps(texture)
+            TextureHandler.mipmaps = mipmaps
+
+        gbuffer = None
+        if GL.gbuffer is not None and material is not None:
+            gbuffer = GL._gbufferAttachments()
+
+        if GL.rasterizer == "vectorized":
+            Rasterizer.draw_triangles(points, GL.sample_frame_buffer, GL.z_buffer, colors,
+                                      vertexColors if colorPerVertex else None,
+                                      vertexTex if texPerVertex and not colorPerVertex else None,
+                                      tile_size=GL.tile_size, mipmaps=mipmaps,
+                                      vertexNormals=vertexNormals,
+                                      vertexPositions=vertexPositions, lights=GL.lights,
+                                      gbuffer=gbuffer, material=material,
+                                      light_tiles=GL._lightTiles() if vertexPositions is not None
+                                      else None)
+        else:
+            GL._drawTrianglesScalar(points, colors,
+                                    colorPerVertex, vertexColors,
+                                    texPerVertex, vertexTex)
+
+
+    @staticmethod
+    def _drawTrianglesScalar(
+                    points, colors=None,
+                    colorPerVertex=False, vertexColors=None,
+                    texPerVertex=False, vertexTex=None
                 ):
+        """Rasteriza os triângulos pixel a pixel (caminho original, mais lento)."""
         
         # Configs
         width = GL.width
@@ -187,9 +335,6 @@ class GL:
             color = np.array([int(255 * colors['emissiveColor'][i]) for i in range(len(colors['emissiveColor']))])
         else:
             color = None
-        
-        if texPerVertex:
-            TextureHandler.generate_mipmaps(texture)
 
         for i in range(0, len(points), 3):
             # Separa os vertices
@@ -255,26 +400,199 @@ class GL:
                                 GL.sample_frame_buffer[y, x] = pointTex * (1 - transparency) + last_color
                             else:
                                 GL.sample_frame_buffer[y, x] = color * (1 - transparency) + last_color
-            
-        GL._drawPixels(width, height, sampling)
     
 
     @staticmethod
-    def _drawPixels(width, height, sampling):
-        # Mapear de volta o frame_buffer super sampled para o menor
-        for x in range(width):
-            for y in range(height):
-                x_sampling = x * sampling
-                y_sampling = y * sampling
+    def clear_sample_buffers():
+        """Apaga o framebuffer super amostrado e o z-buffer no início de cada quadro."""
+        GL.sample_frame_buffer[:] = 0
+        GL.z_buffer[:] = np.inf
+        GL.draw_queue = []
+        GL.light_tiles = None
+
+        if GL.gbuffer is not None:
+            GL._gbufferAttachments()[2][:] = 0
+            GL.materials = []
+            GL.material_index = {}
+            GL.forward_queue = []
 
-                mean_color = np.mean(GL.sample_frame_buffer[
-                                                y_sampling:y_sampling+sampling,
-                                                x_sampling:x_sampling+sampling
-                                            ], axis=(0, 1))
-                
-                gpu.GPU.draw_pixel([x, y], gpu.GPU.RGB8, mean_color.astype(int))
+    @staticmethod
+    def flush():
+        """Desenha os triângulos que estão na fila do modo paralelo."""
+        if GL.tile_pool and GL.draw_queue:
+            GL.tile_pool.draw(GL.draw_queue, GL.tile_size)
+        GL.draw_queue = []
+
+    @staticmethod
+    def _stop_workers():
+        """Encerra os processos (ou threads) do modo paralelo e libera seus buffers."""
+        if GL.tile_pool:
+            GL.sample_frame_buffer = GL.z_buffer = None
+            GL.tile_pool.close()
+            GL.tile_pool = None
+
+    @staticmethod
+    def reset_stats():
+        """Zera os contadores do quadro (chamado no início de cada quadro)."""
+        for counter in GL.stats:
+            GL.stats[counter] = 0
+
+    @staticmethod
+    def resolve():
+        """Mapeia de volta o framebuffer super amostrado para o framebuffer da GPU."""
+        # Chamado uma única vez ao final do quadro (Renderizador.pos). Cada bloco de
+        # sampling x sampling amostras vira um pixel pela média, tudo de uma vez.
+        GL.flush()
+        GL.lighting_pass()
+        GL.fog_pass()
+
+        sampling = GL.sampling
+        samples = GL.sample_frame_buffer.reshape(GL.height, sampling, GL.width, sampling, 3)
+        mean_color = samples.mean(axis=(1, 3)).astype(np.uint8)
+
+        # Assim como o draw_pixel, pixels pretos não são escritos, preservando o que foi
+        # desenhado diretamente na GPU (pontos e linhas 2D)
+        drawn = mean_color.any(axis=2)
+        rows, cols = np.nonzero(drawn)
+        gpu.GPU.draw_pixels(np.column_stack((cols, rows)), gpu.GPU.RGB8, mean_color[drawn])
     
 
+    @staticmethod
+    def lighting_pass():
+        """Ilumina as amostras do G-buffer e desenha os transparentes (modo deferred)."""
+        # Cada amostra visível é iluminada uma única vez, não importa quantos triângulos
+        # foram desenhados sobre ela. As posições no sistema da câmera vêm da profundidade.
+        # Só as luzes que alcançam o tile da amostra são avaliadas: amostras com o mesmo
+        # material e o mesmo conjunto de luzes são iluminadas juntas.
+        if GL.gbuffer is None:
+            return
+
+        normal, albedo, material = GL._gbufferAttachments()
+        rows, cols = np.nonzero(material)
+        if rows.size:
+            positions = GL._viewPositions(cols, rows, GL.z_buffer[rows, cols])
+            if GL.fog_range > 0:
+                # Amostras além do alcance da névoa ficam só com a cor dela (GL.fog_pass)
+                near = np.linalg.norm(positions, axis=1) < GL.fog_range
+                rows, cols, positions = rows[near], cols[near], positions[near]
+            indices = material[rows, cols]
+            normals = normal[rows, cols].astype(np.float64)
+            diffuse = albedo[rows, cols].astype(np.float64)
+
+            light_tiles = GL._lightTiles()
+            size = GL._lightTileSize()
+            light_sets, tile_set = np.unique(light_tiles.reshape(-1, len(GL.lights)), axis=0,
+                                             return_inverse=True)
+            tile_set = tile_set.reshape(light_tiles.shape[:2])[rows // size, cols // size]
+            groups = indices.astype(np.int64) * len(light_sets) + tile_set
+
+            # Ordena as amostras por grupo para cada grupo ser uma fatia contínua
+            order = np.argsort(groups, kind='stable')
+            rows, cols, groups = rows[order], cols[order], groups[order]
+            positions, normals, diffuse = positions[order], normals[order], diffuse[order]
+            starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+            ends = np.r_[starts[1:], len(groups)]
+
+            rgb = np.empty((len(rows), 3))
+            for start, end in zip(starts, ends):
+                index, light_set = divmod(int(groups[start]), len(light_sets))
+                lights = [GL.lights[k] for k in np.flatnonzero(light_sets[light_set])]
+                rgb[start:end] = Lighting.shade(positions[start:end], normals[start:end],
+                                                GL.materials[index - 1], lights,
+                                                diffuse[start:end])
+            GL.sample_frame_buffer[rows, cols] = (rgb * 255).astype(int)
+
+        # Transparentes misturam a cor já iluminada do que está atrás deles
+        for command in GL.forward_queue:
+            GL._drawTriangles(**command)
+        GL.forward_queue = []
+
+    @staticmethod
+    def _viewPositions(x, y, z):
+        """Posições no sistema da câmera das amostras (x, y) da tela com profundidade z."""
+        # Inverte o z do espaço de recorte (z = A z_câmera + B, w = -z_câmera) e a divisão
+        # homogênea nos centros das amostras
+        P = GL.perspective_matrix
+        depth = (z - P[2, 3]) / P[2, 2]
+        w = -depth
+        x_ndc = (x + 0.5) * 2 / (GL.width * GL.sampling) - 1
+        y_ndc = 1 - (y + 0.5) * 2 / (GL.height * GL.sampling)
+        return np.stack((x_ndc * w / P[0, 0], y_ndc * w / P[1, 1], depth), axis=-1)
+
+    @staticmethod
+    def fog_pass():
+        """Mistura as amostras desenhadas com a cor da névoa conforme a distância (Fog)."""
+        # Pós-processamento sobre o quadro super amostrado inteiro, antes do downscaling:
+        # a distância ao observador de cada amostra vem do z-buffer. Amostras sem geometria
+        # (fundo) não recebem névoa. f é a parcela da cor original que sobra.
+        if GL.fog_range <= 0:
+            return
+
+        height, width = GL.z_buffer.shape
+        visibility = GL.fog_range
+        fog = np.array([int(255 * c) for c in GL.fog_color])
+
+        # O fundo tem profundidade infinita
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            distance = np.linalg.norm(GL._viewPositions(np.arange(width)[np.newaxis, :],
+                                                        np.arange(height)[:, np.newaxis],
+                                                        GL.z_buffer), axis=-1)
+            if GL.fog_type == "EXPONENTIAL":
+                f = np.where(distance < visibility,
+                             np.exp(-distance / (visibility - distance)), 0)
+            else:  # LINEAR
+                f = np.clip((visibility - distance) / visibility, 0, 1)
+        f = np.where(np.isfinite(GL.z_buffer), f, 1)[:, :, np.newaxis]
+
+        GL.sample_frame_buffer[:] = f * GL.sample_frame_buffer + (1 - f) * fog
+
+    @staticmethod
+    def _foggedTriangles(view):
+        """Triângulos (3 vértices no sistema da câmera) inteiros além do alcance da névoa."""
+        # Limites inferiores conservadores da distância do observador (origem) a qualquer
+        # ponto do triângulo: a distância ao seu plano e a distância à esfera envolvente.
+        triangles = view.reshape(-1, 3, 3)
+        center = triangles.mean(axis=1)
+        radius = np.linalg.norm(triangles - center[:, np.newaxis], axis=2).max(axis=1)
+
+        normals = Lighting.normalize(np.cross(triangles[:, 1] - triangles[:, 0],
+                                              triangles[:, 2] - triangles[:, 0]))
+        plane = np.abs(np.einsum("ij,ij->i", normals, triangles[:, 0]))
+
+        return np.maximum(np.linalg.norm(center, axis=1) - radius, plane) >= GL.fog_range
+
+    @staticmethod
+    def _material(colors):
+        """Índice (a partir de 1) do material no G-buffer do quadro atual."""
+        key = tuple(np.hstack([colors[name] for name in ("diffuseColor", "emissiveColor",
+                                                         "specularColor", "shininess")]))
+        key += (colors.get("ambientIntensity", 0.2),)
+        if key not in GL.material_index:
+            if len(GL.materials) == np.iinfo(np.uint16).max:
+                raise Exception("Materiais demais para o G-buffer (máximo de 65535 por quadro)")
+            GL.materials.append(colors)
+            GL.material_index[key] = len(GL.materials)
+        return GL.material_index[key]
+
+    @staticmethod
+    def _lightTiles():
+        """Luzes que alcançam cada tile da tela super amostrada no quadro atual."""
+        # Calculado só quando algum fragmento é iluminado e refeito quando as luzes mudam.
+        # Sem tiles (tile_size 0) a tela toda é um único tile.
+        if GL.light_tiles is None:
+            width = GL.width * GL.sampling
+            height = GL.height * GL.sampling
+            GL.light_tiles = Lighting.bin_lights(GL.lights, GL.perspective_matrix, GL.near,
+                                                 width, height, GL._lightTileSize())
+            if GL.lights:
+                GL.stats["lights_per_tile"] = float(GL.light_tiles.sum(axis=2).mean())
+        return GL.light_tiles
+
+    @staticmethod
+    def _lightTileSize():
+        """Lado dos tiles usados no binning das luzes."""
+        return GL.tile_size or max(GL.width, GL.height) * GL.sampling
+
     @staticmethod
     def _inside(vertices, x, y):
         """Função auxiliar para verificar se um ponto está "dentro de um lado" do triângulo."""
@@ -307,61 +625,263 @@ class GL:
         return alpha, beta, gamma
     
 
+    @staticmethod
+    def _vertexStage(points):
+        """Leva uma matriz N x 3 de pontos do modelo para o espaço de recorte (N x 4)."""
+        # A matriz MVP é calculada uma única vez por chamada de desenho e todos os vértices
+        # são transformados juntos como uma matriz 4 x N
+        mvp = GL.perspective_matrix @ GL.viewpoint_matrix @ GL.transformation_stack[-1]
+
+        homogeneous = np.empty((4, len(points)))
+        homogeneous[:3] = points.T
+        homogeneous[3] = 1
+
+        return (mvp @ homogeneous).T
+
+    @staticmethod
+    def _clipTriangles(clip, attributes):
+        """Descarta triângulos fora do volume de visão e recorta os que cruzam o plano próximo."""
+        # clip tem 3 linhas (vértices) por triângulo no espaço de recorte e attributes é uma
+        # lista de matrizes com os atributos de cada vértice (cores, coordenadas de textura),
+        # ou None. Os triângulos que sobram mantêm a ordem original de desenho.
+        triangles = clip.reshape(-1, 3, 4)
+        x, y, z, w = triangles[:, :, 0], triangles[:, :, 1], triangles[:, :, 2], triangles[:, :, 3]
+
+        # Rejeição trivial: os três vértices do lado de fora de um mesmo plano
+        outside = np.zeros(len(triangles), dtype=bool)
+        for d in (w + x, w - x, w + y, w - y, w - z):
+            outside |= (d < 0).all(axis=1)
+
+        # Plano próximo: como a interpolação perspectiva e o z-buffer usam o z do espaço de
+        # recorte, o recorte é feito em z >= near (logo depois do plano próximo z = -w),
+        # garantindo profundidades positivas. Também elimina o que está atrás da câmera.
+        near = z - GL.near
+        behind = near < 0
+        count = behind.sum(axis=1)
+        outside |= count == 3
+
+        # Empacota posição e atributos para interpolar tudo junto
+        packed = np.concatenate([triangles] + [a.reshape(len(triangles), 3, -1)
+                                               for a in attributes if a is not None], axis=2)
+
+        keep = ~outside & (count == 0)
+        result = [packed[keep]]
+        order = [np.flatnonzero(keep)]
+
+        for n_out in (1, 2):
+            selected = np.flatnonzero(~outside & (count == n_out))
+            if len(selected) == 0:
+                continue
+
+            # Gira os vértices para o vértice "diferente" ficar primeiro (mantendo a orientação)
+            first = np.argmax(behind[selected] == (n_out == 1), axis=1)
+            rotation = (first[:, np.newaxis] + np.arange(3)) % 3
+            tri = np.take_along_axis(packed[selected], rotation[:, :, np.newaxis], axis=1)
+            d = np.take_along_axis(near[selected], rotation, axis=1)
+            a, b, c = tri[:, 0], tri[:, 1], tri[:, 2]
+
+            # Pontos onde as arestas A-B e C-A cruzam o plano próximo
+            t_ab = (d[:, 0] / (d[:, 0] - d[:, 1]))[:, np.newaxis]
+            t_ca = (d[:, 2] / (d[:, 2] - d[:, 0]))[:, np.newaxis]
+            p_ab = a + t_ab * (b - a)
+            p_ca = c + t_ca * (a - c)
+
+            if n_out == 1:  # sobra um quadrilátero: dois triângulos
+                result.append(np.stack((p_ab, b, c), axis=1))
+                result.append(np.stack((p_ab, c, p_ca), axis=1))
+                order.extend((selected, selected))
+            else:  # sobra um triângulo menor
+                result.append(np.stack((a, p_ab, p_ca), axis=1))
+                order.append(selected)
+
+        # Ordenação estável para manter a ordem original de desenho
+        sort = np.argsort(np.concatenate(order), kind='stable')
+        packed = np.concatenate(result)[sort].reshape(-1, packed.shape[2])
+
+        clip = packed[:, :4]
+        clipped = []
+        column = 4
+        for attribute in attributes:
+            if attribute is None:
+                clipped.append(None)
+            else:
+                size = attribute.shape[1]
+                clipped.append(packed[:, column:column + size])
+                column += size
+        return clip, clipped
+
+    @staticmethod
+    def _viewportStage(clip):
+        """Leva os vértices do espaço de recorte (N x 4) para a tela super amostrada (N x 3)."""
+        clip = clip.T
+
+        # O z é guardado antes da divisão homogênea (usado na interpolação e no z-buffer)
+        z_values = clip[2]
+
+        # Normalizando a coordenada homogenea e mapeando para a tela
+        screen = GL.mapping_matrix @ (clip / clip[3])
+
+        return np.ascontiguousarray(np.column_stack((screen[0], screen[1], z_values)))
+
+    @staticmethod
+    def _cullTriangles(vertices, attributes, ccw=True, solid=True):
+        """Remove os triângulos de costas para a câmera conforme os campos ccw e solid do X3D."""
+        # A área com sinal na tela diz a orientação de cada triângulo. Como o eixo y da tela
+        # aponta para baixo, área negativa é anti-horário no espaço normalizado, que é a
+        # orientação que o rasterizador cobre. Triângulos degenerados são sempre descartados.
+        triangles = vertices.reshape(-1, 3, 3)
+        x, y = triangles[:, :, 0], triangles[:, :, 1]
+        area = (x[:, 1] - x[:, 0])*(y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0])*(y[:, 1] - y[:, 0])
+
+        front = area < 0 if ccw else area > 0
+        if solid:
+            keep = front
+        else:
+            keep = area != 0
+
+        GL.stats["culled_triangles"] += int(len(triangles) - np.count_nonzero(keep))
+
+        # Inverte a ordem dos vértices (e atributos) dos triângulos que ficaram na orientação
+        # oposta à coberta pelo rasterizador: costas de geometrias não sólidas ou ccw="false"
+        flip = (area > 0)[keep]
+        corners = np.tile([0, 1, 2], (len(flip), 1))
+        corners[flip] = [0, 2, 1]
+        corners = (corners + 3 * np.flatnonzero(keep)[:, np.newaxis]).ravel()
+
+        culled = [None if attribute is None else attribute[corners] for attribute in attributes]
+        return vertices[corners], culled
+
     @staticmethod
     def _drawTriangles3D(
                         point, colors=None,
                         colorPerVertex=False, vertexColors=None,
-                        texPerVertex=False, vertexTex=None, texture=None
+                        texPerVertex=False, vertexTex=None, texture=None, index=None,
+                        ccw=True, solid=True, mipmaps=None, normals=None
                     ):
-        
-        vertices = []
-        # Configs
-        width = GL.width
-        height = GL.height
-
-        # High-resolution framebuffer dimensions
-        high_res_width = width * GL.sampling
-        high_res_height = height * GL.sampling
-
-        # Para cada um dos triangulos
-        for i in range(0, len(point), 9):
-            # Separa os vertices
-            x1, y1, z1, x2, y2, z2, x3, y3, z3 = point[i:i+9]
-
-            triangle = np.array([
-                [x1, x2, x3],
-                [y1, y2, y3],
-                [z1, z2, z3],
-                [1, 1, 1]
-            ])
+        """Transforma os vértices para o espaço da tela e rasteriza os triângulos."""
+        # Se index for informado, point tem apenas os vértices únicos (transformados uma
+        # única vez) e index diz quais deles formam cada triângulo. normals (opcional) tem
+        # a normal de cada vértice de cada triângulo no sistema do modelo.
 
-            triangle = GL.perspective_matrix @ GL.viewpoint_matrix @ GL.transformation_stack[-1] @ triangle
+        points = np.asarray(point, dtype=np.float64).reshape(-1, 3)
+        clip = GL._vertexStage(points)
 
-            # Extract z-values before applying the mapping matrix (i.e., in original 3D space)
-            z_values = triangle[2, :]
+        # Iluminação só com Material, luzes acesas e sem textura; senão fica a cor emissiva
+        lit = (bool(GL.lights) and colors is not None and colors.get("lighting", False)
+               and not texPerVertex)
 
-            # Normalizando a coordenada homogenea
-            triangle = triangle / triangle[3, :]
+        # No modo deferred os transparentes são desenhados (phong) depois da iluminação
+        transparent = colors is not None and float(colors.get("transparency", 0)) > 0
+        deferred = GL.gbuffer is not None and not transparent
 
-            # Mapping matrix to move to screen space
-            mapping_matrix = np.array([
-                [high_res_width / 2, 0, 0, high_res_width / 2],
-                [0, -high_res_height / 2, 0, high_res_height / 2],
-                [0, 0, 1, 0],
-                [0, 0, 0, 1]
-            ])
+        # Com névoa (do quadro anterior, já que o Fog é o último nó da cena) os triângulos
+        # opacos inteiros além de visibilityRange são desenhados só com a cor da névoa
+        fogging = GL.fog_range > 0 and colors is not None and not transparent
 
-            # Apply the mapping to screen space for the x and y coordinates
-            final_triangle = mapping_matrix @ triangle
+        view = GL._viewStage(points) if lit or fogging else None
 
-            # Append the (x, y, z) tuples with z
-            for j in range(3):
-                vertices.append((final_triangle[0, j], final_triangle[1, j], z_values[j]))
+        if index is not None:
+            index = np.asarray(index, dtype=int)
+            clip = clip[index]
+            if view is not None:
+                view = view[index]
 
+        if colorPerVertex:
+            vertexColors = np.asarray(vertexColors, dtype=np.float64).reshape(-1, 3)
+        else:
+            vertexColors = None
+        if texPerVertex:
+            vertexTex = np.asarray(vertexTex, dtype=np.float64).reshape(-1, 2)
+        else:
+            vertexTex = None
+
+        vertexNormals = None
+        vertexPositions = None
+        if lit:
+            vertexNormals = GL._normals(view, ccw, solid, normals)
+            if GL.shading in ("phong", "deferred") and GL.rasterizer == "vectorized":
+                # Posições e normais seguem para o rasterizador, que ilumina cada fragmento
+                # (ou grava a normal no G-buffer, com a posição recuperada da profundidade)
+                vertexPositions = None if deferred else view
+            else:
+                # Gouraud: as cores iluminadas dos vértices são interpoladas no triângulo
+                vertexColors = Lighting.shade(view, vertexNormals, colors, GL.lights, vertexColors)
+                colorPerVertex = True
+                vertexNormals = None
+
+        fogMask = None
+        if fogging:
+            fogged = GL._foggedTriangles(view)
+            if fogged.any():
+                fogMask = np.repeat(fogged, 3).astype(np.float64)[:, np.newaxis]
+
+        attributes = [vertexColors, vertexTex, vertexNormals, vertexPositions, fogMask]
+
+        # Recorte: nada fora da tela ou atrás da câmera chega ao rasterizador
+        clip, attributes = GL._clipTriangles(clip, attributes)
+
+        vertices = GL._viewportStage(clip)
+
+        # Remoção das faces traseiras (ou inversão delas, se a geometria não for sólida)
+        vertices, attributes = GL._cullTriangles(vertices, attributes, ccw, solid)
+        vertexColors, vertexTex, vertexNormals, vertexPositions, fogMask = attributes
+
+        if fogMask is not None:
+            # Sem iluminação nem textura: o fog_pass deixa essas amostras com a cor da névoa
+            fogged = fogMask[:, 0] > 0
+            GL.stats["fogged_triangles"] += int(np.count_nonzero(fogged)) // 3
+            GL._drawTriangles(vertices[fogged], {"emissiveColor": GL.fog_color,
+                                                 "transparency": 0.0})
+            vertices = vertices[~fogged]
+            vertexColors, vertexTex, vertexNormals, vertexPositions = [
+                None if attribute is None else attribute[~fogged]
+                for attribute in (vertexColors, vertexTex, vertexNormals, vertexPositions)]
+
+        material = None
+        if deferred:
+            material = GL._material(colors) if lit else 0
+        elif GL.gbuffer is not None:
+            GL.forward_queue.append({
+                "points": vertices, "colors": colors,
+                "colorPerVertex": colorPerVertex, "vertexColors": vertexColors,
+                "texPerVertex": texPerVertex, "vertexTex": vertexTex, "texture": texture,
+                "mipmaps": mipmaps, "vertexNormals": vertexNormals,
+                "vertexPositions": vertexPositions, "material": None,
+            })
+            return
 
         GL._drawTriangles(vertices, colors,
                           colorPerVertex, vertexColors,
-                          texPerVertex, vertexTex, texture)
+                          texPerVertex, vertexTex, texture, mipmaps,
+                          vertexNormals, vertexPositions, material)
+
+    @staticmethod
+    def _viewStage(points):
+        """Leva uma matriz N x 3 de pontos do modelo para o sistema da câmera (N x 3)."""
+        model_view = GL.viewpoint_matrix @ GL.transformation_stack[-1]
+        return points @ model_view[:3, :3].T + model_view[:3, 3]
+
+    @staticmethod
+    def _normals(view, ccw=True, solid=True, normals=None):
+        """Normais dos vértices (3 por triângulo) no sistema da câmera."""
+        # Sem normals informadas são usadas as normais das faces. As normais do modelo vão
+        # para a câmera pela inversa transposta da model-view (escalas não uniformes). Elas
+        # apontam para o lado da frente definido por ccw e, em geometrias não sólidas,
+        # iluminadas dos dois lados, viram para o observador nas faces de costas.
+        faces = Lighting.face_normals(view)
+        if normals is None:
+            normals = faces
+        else:
+            model_view = GL.viewpoint_matrix @ GL.transformation_stack[-1]
+            normal_matrix = np.linalg.pinv(model_view[:3, :3]).T
+            normals = Lighting.normalize(np.asarray(normals, dtype=np.float64) @ normal_matrix.T)
+        if not ccw:
+            faces, normals = -faces, -normals
+        if not solid:
+            centers = view.reshape(-1, 3, 3).mean(axis=1)
+            back = np.einsum("ij,ij->i", faces[0::3], -centers) < 0
+            normals[np.repeat(back, 3)] *= -1
+        return normals
 
 
     @staticmethod
@@ -376,19 +896,15 @@ class GL:
         # O parâmetro colors é um dicionário com os tipos cores possíveis, para o TriangleSet2D
         # você pode assumir inicialmente o desenho das linhas com a cor emissiva (emissiveColor).
 
-        points = []
-        for i in range(0, len(vertices), 2):
-            x, y = vertices[i], vertices[i+1]
-            # Map the 2D coordinates to screen space
-            screen_x = x * GL.sampling
-            screen_y = y * GL.sampling
-            points.append([screen_x, screen_y, 0])
+        # Map the 2D coordinates to screen space
+        points = np.zeros((len(vertices) // 2, 3))
+        points[:, :2] = np.asarray(vertices, dtype=np.float64).reshape(-1, 2) * GL.sampling
 
         GL._drawTriangles(points, colors)
             
 
     @staticmethod
-    def triangleSet(point, colors):
+    def triangleSet(point, colors, ccw=True, solid=True):
         """Função usada para renderizar TriangleSet."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/rendering.html#TriangleSet
         # Nessa função você receberá pontos no parâmetro point, esses pontos são uma lista
@@ -404,7 +920,7 @@ class GL:
         # (emissiveColor), conforme implementar novos materias você deverá suportar outros
         # tipos de cores.
 
-        GL._drawTriangles3D(point, colors)
+        GL._drawTriangles3D(point, colors, ccw=ccw, solid=solid)
 
         
 
@@ -510,8 +1026,41 @@ class GL:
         if GL.transformation_stack:
             GL.transformation_stack.pop()
 
+        if len(GL.transformation_stack) < GL.inside_depth:
+            GL.inside_depth = 0
+
     @staticmethod
-    def triangleStripSet(point, stripCount, colors):
+    def transform_visible(bboxCenter, bboxSize):
+        """Função usada para testar a caixa envolvente de um Transform contra o volume de visão."""
+        # A função transform_visible é chamada logo depois da transform_in, com a caixa
+        # envolvente dos filhos no sistema local do Transform (centro e tamanho, como nos
+        # campos bboxCenter e bboxSize do X3D). Os 8 cantos vão para o espaço de recorte e a
+        # caixa só é descartada se todos ficarem do lado de fora de um mesmo plano, o mesmo
+        # teste usado para rejeitar triângulos, então nada visível deixa de ser desenhado.
+
+        signs = np.array([[sx, sy, sz] for sx in (-1, 1) for sy in (-1, 1) for sz in (-1, 1)])
+        corners = np.asarray(bboxCenter, dtype=np.float64) + signs * np.asarray(bboxSize) / 2
+
+        # Dentro de um Transform que já está todo no volume de visão não há o que testar
+        depth = len(GL.transformation_stack)
+        if GL.inside_depth and depth > GL.inside_depth:
+            return True
+
+        x, y, z, w = GL._vertexStage(corners).T
+        inside = True
+        for d in (w + x, w - x, w + y, w - y, w - z, z - GL.near):
+            if (d < 0).all():
+                GL.stats["culled_transforms"] += 1
+                return False
+            inside &= bool((d >= 0).all())
+
+        if inside:
+            GL.inside_depth = depth
+        return True
+
+    @staticmethod
+    def triangleStripSet(point, stripCount, colors, ccw=True, solid=True, triangles=None,
+                         normals=None):
         """Função usada para renderizar TriangleStripSet."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/rendering.html#TriangleStripSet
         # A função triangleStripSet é usada para desenhar tiras de triângulos interconectados,
@@ -525,29 +1074,27 @@ class GL:
         # depois 2, 3 e 4, e assim por diante. Cuidado com a orientação dos vértices, ou seja,
         # todos no sentido horário ou todos no sentido anti-horário, conforme especificado.
         
-        idx = 0
-        vertices = []
-        for i, strip in enumerate(stripCount):
-            strip_points = point[idx:idx + strip*3]
-            idx += strip * 3
+        # Triângulos montados pelo parser (x3d.TriangleStripSet) uma única vez, ou montados
+        # aqui se a função for chamada diretamente
+        if triangles is None:
+            triangles = x3d.strip_triangles(stripCount)
 
-            # Process every triangle in the strip
-            for j in range(0, len(strip_points) - 6, 3):
-                # For odd-indexed triangles, reverse the last two vertices
-                if (j // 3) % 2 == 1:
-                    vertices.extend([
-                        strip_points[j], strip_points[j + 1], strip_points[j + 2],
-                        strip_points[j + 6], strip_points[j + 7], strip_points[j + 8],  
-                        strip_points[j + 3], strip_points[j + 4], strip_points[j + 5] 
-                    ])
-                else:
-                    vertices.extend(strip_points[j:j + 9])
+        # Tiras que pedem mais vértices do que existem em point ficam só com os triângulos
+        # completos (os índices crescem ao longo das tiras, então basta cortar o final)
+        count = len(point) // 3
+        if len(triangles) and triangles[-3:].max() >= count:
+            last = np.asarray(triangles).reshape(-1, 3).max(axis=1)
+            triangles = triangles[:3 * np.searchsorted(last, count)]
+            normals = None
 
-        GL._drawTriangles3D(vertices, colors)
+        # Cada vértice é transformado uma única vez e os triângulos usam os índices
+        GL._drawTriangles3D(point, colors, index=triangles, ccw=ccw, solid=solid,
+                            normals=normals)
 
 
     @staticmethod
-    def indexedTriangleStripSet(point, index, colors):
+    def indexedTriangleStripSet(point, index, colors, ccw=True, solid=True, triangles=None,
+                                normals=None):
         """Função usada para renderizar IndexedTriangleStripSet."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/rendering.html#IndexedTriangleStripSet
         # A função indexedTriangleStripSet é usada para desenhar tiras de triângulos
@@ -562,32 +1109,20 @@ class GL:
         # depois 2, 3 e 4, e assim por diante. Cuidado com a orientação dos vértices, ou seja,
         # todos no sentido horário ou todos no sentido anti-horário, conforme especificado.
 
-        vertices = []
-        for i in range(len(index)):
-            # End of strip
-            if -1 in index[i:i+3]:
-                continue
-                
-            v0, v1, v2 = index[i], index[i + 1], index[i + 2]
-            
-            # Switching orientation for every 2 triangles
-            if i % 2 == 1:
-                v0, v1, v2 = v1, v0, v2
-
-            # Extract vertex coordinates
-            triangle = []
-            triangle.extend(point[v0*3:v0*3+3])
-            triangle.extend(point[v1*3:v1*3+3])
-            triangle.extend(point[v2*3:v2*3+3])
+        # Triângulos montados pelo parser (x3d.IndexedTriangleStripSet) uma única vez, ou
+        # montados aqui se a função for chamada diretamente
+        if triangles is None:
+            triangles = x3d.indexed_strip_triangles(index)
 
-            vertices.extend(triangle)
-        
-        GL._drawTriangles3D(vertices, colors)  
+        # Cada vértice é transformado uma única vez e os triângulos usam os índices
+        GL._drawTriangles3D(point, colors, index=triangles, ccw=ccw, solid=solid,
+                            normals=normals)
         
 
     @staticmethod
     def indexedFaceSet(coord, coordIndex, colorPerVertex=False, color=None, colorIndex=None,
-                       texCoord=None, texCoordIndex=None, colors=None, current_texture=None):
+                       texCoord=None, texCoordIndex=None, colors=None, current_texture=None,
+                       ccw=True, solid=True, triangles=None, normals=None):
         """Função usada para renderizar IndexedFaceSet."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/geometry3D.html#IndexedFaceSet
         # A função indexedFaceSet é usada para desenhar malhas de triângulos. Ela funciona de
@@ -610,65 +1145,39 @@ class GL:
         # cor da textura conforme a posição do mapeamento. Dentro da classe GPU já está
         # implementadado um método para a leitura de imagens.
 
-        vertices = []
-        vertexColors = []
-        vertexTex = []
-        v0 = coordIndex[0]
-
         # Tem algum bug que alguns que não deveriam ser colorPerVertex estão mandando True mas sem lista de colors
         if color is None: colorPerVertex = False
         texPerVertex = texCoord is not None
 
-        c0 = None
+        # Triângulos montados pelo parser (x3d.IndexedFaceSet) uma única vez, ou montados
+        # aqui se a função for chamada diretamente
+        if triangles is None:
+            triangles = x3d.IndexedFaceSet.triangulate(coordIndex,
+                                                       colorIndex if colorPerVertex else None,
+                                                       texCoordIndex if texPerVertex else None)
+        index = triangles["coord"]
+
+        vertexColors = None
         if colorPerVertex:
-            if not colorIndex:
-                colorIndex = coordIndex
-            c0 = colorIndex[0]
-        
-        t0 = None
+            vertexColors = np.asarray(color, dtype=np.float64).reshape(-1, 3)[triangles["color"]]
+
+        vertexTex = None
         texture = None
+        mipmaps = None
         if texPerVertex:
-            if not texCoordIndex:
-                texCoordIndex = coordIndex
-            t0 = texCoordIndex[0]
+            vertexTex = np.asarray(texCoord, dtype=np.float64).reshape(-1, 2)[triangles["texCoord"]]
             texture = gpu.GPU.load_texture(current_texture[0])[:, :, :3] # Removing the alpha channel
+            mipmaps = gpu.GPU.load_mipmaps(current_texture[0])
 
-        i = 1
-        while i < len(coordIndex):
-            # Add the coordintes of the three points
-            vertices.extend(coord[v0*3:v0*3+3])
-            vertices.extend(coord[coordIndex[i]*3:coordIndex[i]*3+3])
-            vertices.extend(coord[coordIndex[i+1]*3:coordIndex[i+1]*3+3])
-
-            if colorPerVertex:
-                vertexColors.append(color[c0*3:c0*3+3])
-                vertexColors.append(color[colorIndex[i]*3:colorIndex[i]*3+3])
-                vertexColors.append(color[colorIndex[i+1]*3:colorIndex[i+1]*3+3])
-            
-            if texPerVertex:
-                vertexTex.append(texCoord[t0*2:t0*2+2])
-                vertexTex.append(texCoord[texCoordIndex[i]*2:texCoordIndex[i]*2+2])
-                vertexTex.append(texCoord[texCoordIndex[i+1]*2:texCoordIndex[i+1]*2+2])
-
-            if coordIndex[i+2] == -1:
-                i += 3
-                if i >= len(coordIndex):
-                    break
-                v0 = coordIndex[i]
-                if colorPerVertex:
-                    c0 = colorIndex[i]
-                if texPerVertex:
-                    t0 = texCoordIndex[i]
-            
-            i += 1
-        
-        GL._drawTriangles3D(vertices, colors,
+        # Cada coordenada é transformada uma única vez e os triângulos usam os índices
+        GL._drawTriangles3D(coord, colors,
                             colorPerVertex, vertexColors,
-                            texPerVertex, vertexTex, texture)
+                            texPerVertex, vertexTex, texture, index=index,
+                            ccw=ccw, solid=solid, mipmaps=mipmaps, normals=normals)
 
 
     @staticmethod
-    def box(size, colors):
+    def box(size, colors, solid=True):
         """Função usada para renderizar Boxes."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/geometry3D.html#Box
         # A função box é usada para desenhar paralelepípedos na cena. O Box é centrada no
@@ -678,6 +1187,12 @@ class GL:
         # essa caixa você vai provavelmente querer tesselar ela em triângulos, para isso
         # encontre os vértices e defina os triângulos.
 
+        points, index, normals = GL._tessellation(("box", *size), GL._boxMesh, size)
+        GL._drawTriangles3D(points, colors, index=index, solid=solid, normals=normals)
+
+    @staticmethod
+    def _boxMesh(size):
+        """Vértices, índices e normais dos triângulos de um Box."""
         size_x, size_y, size_z = size
 
         coord = []
@@ -687,19 +1202,23 @@ class GL:
                 for cz in [1, -1]:
                     coord.extend([size_x/2 * cx, size_y/2 * cy, size_z/2 * cz])
 
-        coordIndex = [
-            5, 4, 0, 1, -1,
-            5, 7, 6, 4, -1,
-            4, 6, 2, 0, -1,
-            0, 2, 3, 1, -1,
-            1, 3, 7, 5, -1,
-            7, 3, 2, 6, -1
-        ]
+        # Faces (quadriláteros) divididas em dois triângulos em leque
+        faces = np.array([
+            [5, 4, 0, 1],
+            [5, 7, 6, 4],
+            [4, 6, 2, 0],
+            [0, 2, 3, 1],
+            [1, 3, 7, 5],
+            [7, 3, 2, 6]
+        ])
+        index = faces[:, [0, 1, 2, 0, 2, 3]].ravel()
+        coord = np.array(coord).reshape(-1, 3)
 
-        GL.indexedFaceSet(coord=coord, coordIndex=coordIndex, colors=colors)
+        # Faces planas: cada vértice usa a normal da própria face
+        return coord, index, x3d.mesh_normals(coord, index, 0)
 
     @staticmethod
-    def sphere(radius, colors):
+    def sphere(radius, colors, solid=True):
         """Função usada para renderizar Esferas."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/geometry3D.html#Sphere
         # A função sphere é usada para desenhar esferas na cena. O esfera é centrada no
@@ -708,60 +1227,45 @@ class GL:
         # precisar tesselar ela em triângulos, para isso encontre os vértices e defina
         # os triângulos.
 
-        points = []
-
-        # Definir o passo vertical (APENAS 180°)
-        vertical_step = math.pi / GL.rad_step
-        v_angle = 0
-
-        prev_height = radius
-        prev_radius = 0
-
-        # Loop vertical para saber a altura dos circulos
-        while v_angle <= math.pi:
-            # Definir o passo horizontal de acordo com o comprimento da circunferência?
-            horizontal_step = 2 * vertical_step
-            h_angle = 0
-            
-            height = math.cos(v_angle) * radius
-            curr_radius = math.sin(v_angle) * radius
-
-            prev_x_top, prev_z_top = prev_radius * math.cos(h_angle), prev_radius * math.sin(h_angle)
-            prev_x_bottom, prev_z_bottom = curr_radius * math.cos(h_angle), curr_radius * math.sin(h_angle)
-
-            h_angle += horizontal_step
-
-            # Loop para fazer o mesmo processo do cilindro
-            while h_angle <= 2*math.pi + horizontal_step: # NOT SURE WHY HAD TO AD
-                x_top, z_top = prev_radius * math.cos(h_angle), prev_radius * math.sin(h_angle)
-                x_bottom, z_bottom = curr_radius * math.cos(h_angle), curr_radius * math.sin(h_angle)
-
-                points.extend([x_bottom, height, z_bottom])
-                points.extend([prev_x_bottom, height, prev_z_bottom])
-                points.extend([prev_x_top, prev_height, prev_z_top])
-
-                points.extend([prev_x_top, prev_height, prev_z_top])
-                points.extend([x_top, prev_height, z_top])
-                points.extend([x_bottom, height, z_bottom])
-
-                prev_x_top, prev_z_top = x_top, z_top
-                prev_x_bottom, prev_z_bottom = x_bottom, z_bottom
-
-                h_angle += horizontal_step
-            
-            prev_height = height
-            prev_radius = curr_radius
-
-            v_angle += vertical_step
-            
-        GL._drawTriangles3D(point=points, colors=colors)
+        segments = GL._segments(radius)
+        points, index, normals = GL._tessellation(("sphere", radius, segments),
+                                                  GL._sphereMesh, radius, segments)
+        GL._drawTriangles3D(points, colors, index=index, solid=solid, normals=normals)
 
         # O print abaixo é só para vocês verificarem o funcionamento, DEVE SER REMOVIDO.
         print("Sphere : radius = {0}".format(radius)) # imprime no terminal o raio da esfera
         print("Sphere : colors = {0}".format(colors)) # imprime no terminal as cores
 
     @staticmethod
-    def cone(bottomRadius, height, colors):
+    def _sphereMesh(radius, segments):
+        """Vértices, índices e normais dos triângulos de uma esfera."""
+        # Círculos (paralelos) do polo de cima (0) ao de baixo (pi), cada um percorrido
+        # por ângulos horizontais de 0 até pouco além de 2*pi
+        vertical_step = math.pi / segments
+        horizontal_step = 2 * vertical_step
+        v_angles = GL._angles(vertical_step, math.pi)
+        h_angles = GL._angles(horizontal_step, 2*math.pi + horizontal_step)
+
+        heights = np.cos(v_angles) * radius
+        radii = np.sin(v_angles) * radius
+
+        # Grade de vértices: uma linha por paralelo, uma coluna por ângulo horizontal
+        grid = np.empty((len(v_angles), len(h_angles), 3))
+        grid[:, :, 0] = radii[:, np.newaxis] * np.cos(h_angles)
+        grid[:, :, 1] = heights[:, np.newaxis]
+        grid[:, :, 2] = radii[:, np.newaxis] * np.sin(h_angles)
+
+        # A normal de cada vértice é a direção do centro até ele
+        normals = np.empty_like(grid)
+        normals[:, :, 0] = np.sin(v_angles)[:, np.newaxis] * np.cos(h_angles)
+        normals[:, :, 1] = np.cos(v_angles)[:, np.newaxis]
+        normals[:, :, 2] = np.sin(v_angles)[:, np.newaxis] * np.sin(h_angles)
+
+        index = GL._bandIndex(len(v_angles), len(h_angles))
+        return grid.reshape(-1, 3), index, normals.reshape(-1, 3)[index]
+
+    @staticmethod
+    def cone(bottomRadius, height, colors, solid=True):
         """Função usada para renderizar Cones."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/geometry3D.html#Cone
         # A função cone é usada para desenhar cones na cena. O cone é centrado no
@@ -771,39 +1275,34 @@ class GL:
         # Para desenha esse cone você vai precisar tesselar ele em triângulos, para isso
         # encontre os vértices e defina os triângulos.
 
-        points = []
-        half_height = height/2
-
-        # Pega o ponto do topo
-        top = [0, half_height, 0]
-
-        # Define o passo (em rad) do circulo da base
-        rad_step = 2 * math.pi/GL.rad_step
-        angle = 0
+        segments = GL._segments(math.hypot(bottomRadius, height/2))
+        points, index, normals = GL._tessellation(("cone", bottomRadius, height, segments),
+                                                  GL._coneMesh, bottomRadius, height, segments)
+        GL._drawTriangles3D(points, colors, index=index, solid=solid, normals=normals)
 
-        prev_x = bottomRadius * math.cos(angle)
-        prev_z = bottomRadius * math.sin(angle)
-
-        angle += rad_step
-
-        # Gira em sentido anti horário conectando triangulos
-        while angle <= 2 *math.pi:
-            x = bottomRadius * math.cos(angle)
-            z = bottomRadius * math.sin(angle)
-
-            points.extend(([x, -half_height, z]))
-            points.extend([prev_x, -half_height, prev_z])
-            points.extend(top)
+    @staticmethod
+    def _coneMesh(bottomRadius, height, segments):
+        """Vértices, índices e normais dos triângulos de um cone."""
+        half_height = height/2
 
-            prev_x, prev_z = x, z
-            angle += rad_step
+        # Círculo da base, em sentido anti horário, e o topo como último vértice
+        angles = GL._angles(2 * math.pi/segments, 2 * math.pi)
+        points = np.empty((len(angles) + 1, 3))
+        points[:-1, 0] = bottomRadius * np.cos(angles)
+        points[:-1, 1] = -half_height
+        points[:-1, 2] = bottomRadius * np.sin(angles)
+        points[-1] = [0, half_height, 0]
 
-        # Passa para o drawTriangles3d (lista de vertices solta)
-        GL._drawTriangles3D(point=points, colors=colors)
+        # Cada par de vértices consecutivos da base forma um triângulo com o topo
+        k = np.arange(1, len(angles))
+        index = np.stack([k, k - 1, np.full_like(k, len(angles))], axis=1).ravel()
 
+        # Lateral suavizada; no topo, compartilhado por todas as faces, cada face só se
+        # mistura com as vizinhas de até 90 graus
+        return points, index, x3d.mesh_normals(points, index, math.pi / 2)
 
     @staticmethod
-    def cylinder(radius, height, colors):
+    def cylinder(radius, height, colors, solid=True):
         """Função usada para renderizar Cilindros."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/geometry3D.html#Cylinder
         # A função cylinder é usada para desenhar cilindros na cena. O cilindro é centrado no
@@ -813,35 +1312,93 @@ class GL:
         # Para desenha esse cilindro você vai precisar tesselar ele em triângulos, para isso
         # encontre os vértices e defina os triângulos.
 
-        points = []
-
-        angle = 0
-        rad_step = 2 * math.pi/GL.rad_step
-
-        prev_x = radius * math.cos(angle)
-        prev_z = radius * math.sin(angle)
+        segments = GL._segments(math.hypot(radius, height/2))
+        points, index, normals = GL._tessellation(("cylinder", radius, height, segments),
+                                                  GL._cylinderMesh, radius, height, segments)
+        GL._drawTriangles3D(points, colors, index=index, solid=solid, normals=normals)
 
+    @staticmethod
+    def _cylinderMesh(radius, height, segments):
+        """Vértices, índices e normais dos triângulos de um cilindro."""
         half_height = height/2
 
-         # Gira em sentido anti horário conectando triangulos
-        while angle <= 2 *math.pi:
-            x = radius * math.cos(angle)
-            z = radius * math.sin(angle)
+        # Círculo de cima (linha 0) e de baixo (linha 1), em sentido anti horário
+        angles = GL._angles(2 * math.pi/segments, 2 * math.pi)
+        grid = np.empty((2, len(angles), 3))
+        grid[:, :, 0] = radius * np.cos(angles)
+        grid[0, :, 1] = half_height
+        grid[1, :, 1] = -half_height
+        grid[:, :, 2] = radius * np.sin(angles)
+
+        # Normais horizontais, do eixo até o vértice
+        normals = np.zeros_like(grid)
+        normals[:, :, 0] = np.cos(angles)
+        normals[:, :, 2] = np.sin(angles)
 
-            points.extend(([x, -half_height, z]))
-            points.extend([prev_x, -half_height, prev_z])
-            points.extend([prev_x, half_height, prev_z])
+        index = GL._bandIndex(2, len(angles))
+        return grid.reshape(-1, 3), index, normals.reshape(-1, 3)[index]
 
-            points.extend([prev_x, half_height, prev_z])
-            points.extend(([x, half_height, z]))
-            points.extend([x, -half_height, z])
+    @staticmethod
+    def _segments(radius):
+        """Segmentos de uma volta para uma primitiva com esfera envolvente de raio radius."""
+        # A esfera envolvente (centrada na origem do sistema local) é projetada na tela com a
+        # matriz do Transform atual, a câmera e a perspectiva. Um polígono regular de n lados
+        # inscrito num círculo de raio r (em pixels) se afasta dele no máximo r*(1-cos(pi/n)),
+        # então n é o menor valor que mantém esse erro abaixo de lod_error.
+        model_view = GL.viewpoint_matrix @ GL.transformation_stack[-1]
+        scale = np.linalg.norm(model_view[:3, :3], axis=0).max()
+        radius *= scale
+        depth = -model_view[2, 3] - radius  # ponto da esfera mais próximo da câmera
+
+        if depth <= GL.near or GL.lod_error <= 0:
+            return GL.rad_step
+        pixels = radius / depth * GL.perspective_matrix[1, 1] * GL.height * GL.sampling / 2
+
+        if pixels <= GL.lod_error:
+            segments = GL.min_segments
+        else:
+            segments = math.ceil(math.pi / math.acos(1 - GL.lod_error / pixels))
+        return int(min(max(segments, GL.min_segments), GL.rad_step))
 
-            prev_x, prev_z = x, z
-            angle += rad_step
+    @staticmethod
+    def _angles(step, limit):
+        """Ângulos 0, step, 2*step, ... até limit, acumulados como em um laço."""
+        # np.cumsum soma em sequência, então os ângulos (e a quantidade deles) são os
+        # mesmos de um laço while que soma step a cada volta
+        angles = np.zeros(int(limit / step) + 3)
+        angles[1:] = np.cumsum(np.full(len(angles) - 1, step))
+        return angles[angles <= limit]
 
-        # Passa para o drawTriangles3d (lista de vertices solta)
-        GL._drawTriangles3D(point=points, colors=colors)
+    @staticmethod
+    def _bandIndex(rows, columns):
+        """Índices dos triângulos que ligam linhas consecutivas de uma grade de vértices."""
+        # Cada célula (linha de cima t, linha de baixo b) vira dois triângulos:
+        # (b[k], b[k-1], t[k-1]) e (t[k-1], t[k], b[k])
+        top = np.arange(rows - 1)[:, np.newaxis] * columns + np.arange(1, columns)
+        bottom = top + columns
+        index = np.stack([bottom, bottom - 1, top - 1, top - 1, top, bottom], axis=-1)
+        return index.ravel()
 
+    @staticmethod
+    def _tessellation(key, build, *args):
+        """Malha (vértices, índices, normais) de uma primitiva, gerada uma vez por chave."""
+        # Cache LRU limitado: animações redesenham as mesmas primitivas a cada quadro
+        mesh = GL.tessellations.get(key)
+        if mesh is not None:
+            GL.tessellations.move_to_end(key)  # mais recente
+            return mesh
+
+        points, index, normals = build(*args)
+        points = np.ascontiguousarray(points, dtype=np.float64)
+        index = np.ascontiguousarray(index, dtype=int)
+        normals = np.ascontiguousarray(normals, dtype=np.float32)  # uma por vértice de triângulo
+        for array in (points, index, normals):
+            array.flags.writeable = False
+
+        mesh = GL.tessellations[key] = (points, index, normals)
+        while len(GL.tessellations) > GL.max_tessellations:
+            GL.tessellations.popitem(last=False)
+        return mesh
 
     @staticmethod
     def navigationInfo(headlight):
@@ -853,8 +1410,11 @@ class GL:
         # A luz headlight deve ser direcional, ter intensidade = 1, cor = (1 1 1),
         # ambientIntensity = 0,0 e direção = (0 0 −1).
 
-        # O print abaixo é só para vocês verificarem o funcionamento, DEVE SER REMOVIDO.
-        print("NavigationInfo : headlight = {0}".format(headlight)) # imprime no terminal
+        # O NavigationInfo é renderizado antes das luzes, então as luzes do quadro começam aqui
+        GL.lights = []
+        GL.light_tiles = None
+        if headlight:
+            GL.lights.append(Lighting.directional(0.0, [1, 1, 1], 1, [0, 0, -1]))
 
     @staticmethod
     def directionalLight(ambientIntensity, color, intensity, direction):
@@ -866,14 +1426,15 @@ class GL:
         # que emana da fonte de luz no sistema de coordenadas local. A luz é emitida ao
         # longo de raios paralelos de uma distância infinita.
 
-        # O print abaixo é só para vocês verificarem o funcionamento, DEVE SER REMOVIDO.
-        print("DirectionalLight : ambientIntensity = {0}".format(ambientIntensity))
-        print("DirectionalLight : color = {0}".format(color)) # imprime no terminal
-        print("DirectionalLight : intensity = {0}".format(intensity)) # imprime no terminal
-        print("DirectionalLight : direction = {0}".format(direction)) # imprime no terminal
+        # A direção vai para o sistema da câmera, onde a iluminação é calculada
+        model_view = GL.viewpoint_matrix @ GL.transformation_stack[-1]
+        direction = model_view[:3, :3] @ np.asarray(direction, dtype=np.float64)
+        GL.lights.append(Lighting.directional(ambientIntensity, color, intensity, direction))
+        GL.light_tiles = None
 
     @staticmethod
-    def pointLight(ambientIntensity, color, intensity, location):
+    def pointLight(ambientIntensity, color, intensity, location, attenuation=(1, 0, 0),
+                   radius=100):
         """Luz pontual."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/lighting.html#PointLight
         # Fonte de luz pontual em um local 3D no sistema de coordenadas local. Uma fonte
@@ -882,14 +1443,16 @@ class GL:
         # a geometria em um raio de sua localização. O campo do raio deve ser maior ou igual a
         # zero. A iluminação do nó PointLight diminui com a distância especificada.
 
-        # O print abaixo é só para vocês verificarem o funcionamento, DEVE SER REMOVIDO.
-        print("PointLight : ambientIntensity = {0}".format(ambientIntensity))
-        print("PointLight : color = {0}".format(color)) # imprime no terminal
-        print("PointLight : intensity = {0}".format(intensity)) # imprime no terminal
-        print("PointLight : location = {0}".format(location)) # imprime no terminal
+        # Posição e raio vão para o sistema da câmera, onde a iluminação é calculada
+        model_view = GL.viewpoint_matrix @ GL.transformation_stack[-1]
+        location = model_view[:3, :3] @ np.asarray(location, dtype=np.float64) + model_view[:3, 3]
+        radius *= np.linalg.norm(model_view[:3, :3], axis=0).max()
+        GL.lights.append(Lighting.point(ambientIntensity, color, intensity, location,
+                                        attenuation, radius))
+        GL.light_tiles = None
 
     @staticmethod
-    def fog(visibilityRange, color):
+    def fog(visibilityRange, color, fogType="LINEAR"):
         """Névoa."""
         # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/environmentalEffects.html#Fog
         # O nó Fog fornece uma maneira de simular efeitos atmosféricos combinando objetos
@@ -900,9 +1463,10 @@ class GL:
         # desenhados com uma cor de cor constante. Objetos muito próximos do visualizador
         # são muito pouco misturados com a cor do nevoeiro.
 
-        # O print abaixo é só para vocês verificarem o funcionamento, DEVE SER REMOVIDO.
-        print("Fog : color = {0}".format(color)) # imprime no terminal
-        print("Fog : visibilityRange = {0}".format(visibilityRange))
+        # A mistura é feita no fim do quadro (GL.fog_pass), sobre a imagem inteira
+        GL.fog_range = visibilityRange
+        GL.fog_color = color
+        GL.fog_type = fogType
 
     @staticmethod
     def timeSensor(cycleInterval, loop):
@@ -10,6 +10,10 @@ Data: 31 de Agosto de 2020
 """
 
 import os           # Para rotinas do sistema operacional
+import json         # Para os metadados do cache de texturas em disco
+import hashlib      # Para os nomes dos arquivos do cache de texturas em disco
+import tempfile     # Para escrever o cache de texturas em disco de forma atômica
+from collections import OrderedDict  # Para o cache LRU de texturas
 
 # Numpy
 import numpy as np
@@ -17,6 +21,9 @@ import numpy as np
 # Pillow
 from PIL import Image
 
+# Mipmaps das texturas
+from texture import TextureHandler
+
 class FrameBuffer:
     """Organiza objetos FrameBuffer (FrameBuffer Objects)."""
 
@@ -25,6 +32,11 @@ class FrameBuffer:
         self.color = np.empty(0)
         self.depth = np.empty(0)
 
+        # Anexos extras do G-buffer (renderização deferred)
+        self.normal = np.empty(0)
+        self.albedo = np.empty(0)
+        self.material = np.empty(0)
+
 
 class GPU:
     """Classe que representa o funcionamento de uma GPU."""
@@ -38,15 +50,31 @@ class GPU:
     RGBA8 = 0b010  # Valores para Vermelho, Verde, Azul e Transpareência de 8bits cada (0-255)
     DEPTH_COMPONENT16 = 0b101  # Valores para Profundidade de 16bits cada (0-65535)
     DEPTH_COMPONENT32F = 0b110  # Valores para Profundidade de 32bits em float
+    RGB32F = 0b011  # Vetores de 3 valores em float de 32bits (normais, cores lineares)
+    R16UI = 0b100  # Um valor inteiro sem sinal de 16bits (0-65535) por pixel (índices)
 
     COLOR_ATTACHMENT = 0  # Para FrameBuffer Object identificar memória de imagem de cores
     DEPTH_ATTACHMENT = 1  # Para FrameBuffer Object identificar memória de imagem de profundidade
+    NORMAL_ATTACHMENT = 2  # Normais do G-buffer (RGB32F)
+    ALBEDO_ATTACHMENT = 3  # Cor difusa do G-buffer (RGB32F)
+    MATERIAL_ATTACHMENT = 4  # Índice do material do G-buffer (R16UI)
 
     # Atributos estáticos
     image_file = None
     frame_buffer = None
     path = "."
 
+    # Cache LRU das texturas lidas (caminho, data de modificação) -> imagem e mipmaps
+    texture_cache = OrderedDict()
+    texture_cache_budget = 256 * 1024 * 1024  # orçamento em bytes
+    texture_cache_bytes = 0
+    texture_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    # Diretório do cache em disco das texturas decodificadas e mipmaps (None desliga)
+    texture_cache_dir = os.environ.get("RENDERIZADOR_CACHE",
+                                       os.path.join(os.path.expanduser("~"), ".cache",
+                                                    "renderizador"))
+
     def __init__(self, image_file, path):
         """Define o nome do arquivo para caso se salvar o framebuffer."""
         GPU.image_file = image_file
@@ -107,6 +135,16 @@ class GPU:
                 depth = 1
             # Aloca espaço definindo todos os valores como 1 (profundidade máxima)
             GPU.frame_buffer[position].depth = np.ones((height, width, depth), dtype=dtype)
+        elif attachment in (GPU.NORMAL_ATTACHMENT, GPU.ALBEDO_ATTACHMENT, GPU.MATERIAL_ATTACHMENT):
+            if mode == GPU.RGB32F:
+                buffer = np.zeros((height, width, 3), dtype=np.float32)
+            elif mode == GPU.R16UI:
+                buffer = np.zeros((height, width, 1), dtype=np.uint16)
+            else:
+                raise Exception(f"Modo inválido para o anexo {attachment} do Frame buffer ({mode})")
+            name = {GPU.NORMAL_ATTACHMENT: "normal", GPU.ALBEDO_ATTACHMENT: "albedo",
+                    GPU.MATERIAL_ATTACHMENT: "material"}[attachment]
+            setattr(GPU.frame_buffer[position], name, buffer)
 
     @staticmethod
     def clear_color(color):
@@ -221,6 +259,78 @@ class GPU:
             # Retorna valor dos dados do Framebuffer
             return data
 
+    @staticmethod
+    def _attachment(position, mode):
+        """Retorna a memória do Framebuffer (cor ou profundidade) para o modo informado."""
+        if mode in (GPU.RGB8, GPU.RGBA8):  # cores
+            buffer = GPU.frame_buffer[position].color
+            if buffer.size == 0:
+                raise Exception(f"Frame buffer {position} não alocado com o canal de cor")
+        elif mode in (GPU.DEPTH_COMPONENT16, GPU.DEPTH_COMPONENT32F):  # profundidade
+            buffer = GPU.frame_buffer[position].depth
+            if buffer.size == 0:
+                raise Exception(f"Frame buffer {position} não alocado com o canal de profundidade")
+        else:
+            raise Exception(f"Modo inválido de acesso ao Frame buffer ({mode})")
+        return buffer
+
+    @staticmethod
+    def _check_data(mode, data, shape):
+        """Verifica (uma única vez para o bloco todo) formato e faixa dos dados."""
+        data = np.asarray(data)
+        if mode in (GPU.RGB8, GPU.RGBA8):  # cores
+            if data.shape != shape + (mode+2,) or data.dtype.kind not in "uif" or \
+               (data.dtype != np.uint8 and data.size and (data.min() < 0 or data.max() > 255)):
+                raise Exception(f"Valores do Frame buffer devem estar em vetores de dimensão [{mode+2}] ser inteiros e estar entre 0 e 255")
+        else:  # profundidade
+            if data.shape == shape + (1,):
+                data = data[..., 0]
+            if data.shape != shape or data.dtype.kind not in "uif":
+                raise Exception(f"Valores do Frame buffer devem ter um único valor numérico por pixel: {data.shape}")
+            data = data[..., np.newaxis]
+        return data
+
+    @staticmethod
+    def draw_region(coord, mode, data):
+        """Define os valores de uma região retangular do framebuffer (coord = canto superior esquerdo)."""
+        buffer = GPU._attachment(GPU.draw_framebuffer, mode)
+        data = np.asarray(data)
+        height, width = data.shape[:2]
+
+        # Verifica se escrita é em um local válido
+        if coord[0] < 0 or coord[0] + width > buffer.shape[1] or coord[1] < 0 or coord[1] + height > buffer.shape[0]:
+            raise Exception(f"Acesso irregular de escrita na região [{coord[0]}, {coord[1]}] de tamanho {width, height} do Framebuffer {buffer.shape[1], buffer.shape[0]}")
+
+        # Grava dados diretamente na memória do Framebuffer
+        buffer[coord[1]:coord[1]+height, coord[0]:coord[0]+width] = GPU._check_data(mode, data, (height, width))
+
+    @staticmethod
+    def draw_pixels(coords, mode, data):
+        """Define os valores de vários pixels do framebuffer (coords é uma matriz N x 2 de [x, y])."""
+        buffer = GPU._attachment(GPU.draw_framebuffer, mode)
+        coords = np.asarray(coords, dtype=int).reshape(-1, 2)
+        if coords.size == 0:
+            return
+
+        # Verifica se escrita é em um local válido
+        if coords.min() < 0 or coords[:, 0].max() >= buffer.shape[1] or coords[:, 1].max() >= buffer.shape[0]:
+            raise Exception(f"Acesso irregular de escrita em posições fora do Framebuffer {buffer.shape[1], buffer.shape[0]}")
+
+        # Grava dados diretamente na memória do Framebuffer
+        buffer[coords[:, 1], coords[:, 0]] = GPU._check_data(mode, data, (len(coords),))
+
+    @staticmethod
+    def read_region(coord, size, mode):
+        """Retorna uma região retangular do framebuffer (uma view, sem cópia)."""
+        buffer = GPU._attachment(GPU.read_framebuffer, mode)
+        width, height = size
+
+        # Verifica se leitura é em um local válido
+        if coord[0] < 0 or coord[0] + width > buffer.shape[1] or coord[1] < 0 or coord[1] + height > buffer.shape[0]:
+            raise Exception(f"Acesso irregular de leitura na região [{coord[0]}, {coord[1]}] de tamanho {width, height} do Framebuffer {buffer.shape[1], buffer.shape[0]}")
+
+        return buffer[coord[1]:coord[1]+height, coord[0]:coord[0]+width]
+
     @staticmethod
     def save_image():
         """Método para salvar a imagem do framebuffer em um arquivo."""
@@ -237,10 +347,144 @@ class GPU:
     @staticmethod
     def load_texture(textura):
         """Método para ler textura."""
-        file = os.path.join(GPU.path, textura)
-        imagem = Image.open(file).transpose(Image.TRANSPOSE)
-        matriz = np.array(imagem)
-        return matriz
+        # A imagem decodificada fica no cache, então só é lida do disco uma vez. O array
+        # retornado é compartilhado e por isso somente leitura.
+        return GPU._texture_entry(textura)["texture"]
+
+    @staticmethod
+    def load_mipmaps(textura):
+        """Retorna os mipmaps (sem o canal alfa) da textura, gerados uma única vez."""
+        entry = GPU._texture_entry(textura)
+        if entry["mipmaps"] is None:
+            levels = GPU._load_cached_arrays(entry["source"], "mipmaps")
+            if levels is None:
+                levels = TextureHandler.build_mipmaps(entry["texture"][:, :, :3])[1:]
+                GPU._store_cached_arrays(entry["source"], "mipmaps", levels)
+
+            entry["mipmaps"] = [entry["texture"][:, :, :3]] + list(levels)
+            size = sum(level.nbytes for level in levels)
+            entry["bytes"] += size
+            GPU.texture_cache_bytes += size
+            GPU._evict_textures()
+        return entry["mipmaps"]
+
+    @staticmethod
+    def _texture_entry(textura):
+        """Busca a textura no cache LRU, lendo o arquivo se ela não estiver lá."""
+        # A chave é o caminho resolvido, a data de modificação e o tamanho do arquivo,
+        # assim uma textura alterada no disco é lida de novo
+        file = os.path.realpath(os.path.join(GPU.path, textura))
+        stat = os.stat(file)
+        key = (file, stat.st_mtime_ns, stat.st_size)
+
+        entry = GPU.texture_cache.get(key)
+        if entry is not None:
+            GPU.texture_cache.move_to_end(key)  # mais recente
+            GPU.texture_cache_stats["hits"] += 1
+            return entry
+
+        GPU.texture_cache_stats["misses"] += 1
+
+        # Versões antigas do mesmo arquivo não serão mais usadas
+        for old in [old for old in GPU.texture_cache if old[0] == file]:
+            GPU._drop_texture(old)
+
+        # Tenta o cache em disco (mapeado em memória) antes de decodificar a imagem
+        cached = GPU._load_cached_arrays(key, "texture")
+        if cached is not None:
+            matriz = cached[0]
+        else:
+            imagem = Image.open(file).transpose(Image.TRANSPOSE)
+            matriz = np.array(imagem)
+            matriz.setflags(write=False)
+            GPU._store_cached_arrays(key, "texture", [matriz])
+
+        entry = {"texture": matriz, "mipmaps": None, "bytes": matriz.nbytes, "source": key}
+        GPU.texture_cache[key] = entry
+        GPU.texture_cache_bytes += entry["bytes"]
+        GPU._evict_textures()
+        return entry
+
+    @staticmethod
+    def _cache_files(source, kind):
+        """Caminhos dos metadados e dos arrays de uma textura no cache em disco."""
+        name = hashlib.sha1(source[0].encode()).hexdigest() + "." + kind
+        base = os.path.join(GPU.texture_cache_dir, name)
+        return base + ".json", base + ".{0}.npy"
+
+    @staticmethod
+    def _load_cached_arrays(source, kind):
+        """Abre os arrays do cache em disco com mmap, se estiverem atualizados."""
+        # source é (caminho, data de modificação, tamanho) do arquivo da textura. Com
+        # mmap os processos que renderizam na mesma máquina dividem as mesmas páginas.
+        if not GPU.texture_cache_dir:
+            return None
+
+        meta_file, array_file = GPU._cache_files(source, kind)
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            if [meta["source"], meta["mtime_ns"], meta["size"]] != list(source):
+                return None  # arquivo da textura mudou
+            return [np.load(array_file.format(i), mmap_mode="r") for i in range(meta["count"])]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _store_cached_arrays(source, kind, arrays):
+        """Grava os arrays no cache em disco (falhas de escrita são ignoradas)."""
+        if not GPU.texture_cache_dir:
+            return
+
+        meta_file, array_file = GPU._cache_files(source, kind)
+        meta = {"source": source[0], "mtime_ns": source[1], "size": source[2],
+                "count": len(arrays)}
+        try:
+            os.makedirs(GPU.texture_cache_dir, exist_ok=True)
+
+            # Cada arquivo é escrito em um temporário e renomeado, e os metadados por
+            # último, para outro processo nunca abrir um cache pela metade
+            for i, array in enumerate(arrays):
+                GPU._replace_file(array_file.format(i), lambda f, a=array: np.save(f, a))
+            GPU._replace_file(meta_file, lambda f: f.write(json.dumps(meta).encode()))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _replace_file(path, write):
+        """Escreve um arquivo de forma atômica (temporário + rename)."""
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(handle, "wb") as f:
+                write(f)
+            os.replace(temporary, path)
+        except OSError:
+            os.unlink(temporary)
+            raise
+
+    @staticmethod
+    def _evict_textures():
+        """Remove as texturas usadas há mais tempo até o cache caber no orçamento."""
+        # A textura mais recente nunca é removida, mesmo se sozinha passar do orçamento
+        while GPU.texture_cache_bytes > GPU.texture_cache_budget and len(GPU.texture_cache) > 1:
+            GPU._drop_texture(next(iter(GPU.texture_cache)))
+            GPU.texture_cache_stats["evictions"] += 1
+
+    @staticmethod
+    def _drop_texture(key):
+        """Remove uma textura do cache."""
+        GPU.texture_cache_bytes -= GPU.texture_cache.pop(key)["bytes"]
+
+    @staticmethod
+    def get_attachment(position, attachment):
+        """Retorna a memória de um anexo do FrameBuffer (usado pelo G-buffer)."""
+        fbo = GPU.frame_buffer[position]
+        buffer = {GPU.COLOR_ATTACHMENT: fbo.color, GPU.DEPTH_ATTACHMENT: fbo.depth,
+                  GPU.NORMAL_ATTACHMENT: fbo.normal, GPU.ALBEDO_ATTACHMENT: fbo.albedo,
+                  GPU.MATERIAL_ATTACHMENT: fbo.material}[attachment]
+        if buffer.size == 0:
+            raise Exception(f"Frame buffer {position} não alocado com o anexo {attachment}")
+        return buffer
 
     @staticmethod
     def get_frame_buffer():
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# pylint: disable=invalid-name
+
+"""
+Iluminação (equação de iluminação do X3D) avaliada em vetores de pontos.
+
+Desenvolvido por: <JOÃO LUCAS CADORNIGA>
+Disciplina: Computação Gráfica
+Data: <10/08/2024>
+"""
+
+import numpy as np  # Biblioteca do Numpy
+
+
+class Lighting:
+    """Avalia luzes direcionais e pontuais em vários pontos de uma vez com o Numpy."""
+
+    @staticmethod
+    def directional(ambientIntensity, color, intensity, direction):
+        """Luz direcional com a direção já no sistema de coordenadas da câmera."""
+        direction = np.asarray(direction, dtype=np.float64)
+        return {
+            "type": "directional",
+            "ambientIntensity": float(ambientIntensity),
+            "color": np.asarray(color, dtype=np.float64),
+            "intensity": float(intensity),
+            "direction": direction / np.linalg.norm(direction),
+        }
+
+    @staticmethod
+    def point(ambientIntensity, color, intensity, location, attenuation, radius):
+        """Luz pontual com a posição (e o raio) já no sistema de coordenadas da câmera."""
+        return {
+            "type": "point",
+            "ambientIntensity": float(ambientIntensity),
+            "color": np.asarray(color, dtype=np.float64),
+            "intensity": float(intensity),
+            "location": np.asarray(location, dtype=np.float64),
+            "attenuation": [float(a) for a in attenuation],
+            "radius": float(radius),
+        }
+
+    @staticmethod
+    def bin_lights(lights, projection, near, width, height, tile_size):
+        """Luzes que alcançam cada tile da tela (booleanos tiles em y x tiles em x x luzes)."""
+        # A esfera de influência (location e radius, no sistema da câmera) de cada luz
+        # pontual é projetada na tela super amostrada de largura width e altura height. Como
+        # x/d é monótono em x e na distância d, os extremos da projeção da caixa em volta da
+        # esfera estão nos seus cantos (com d limitado ao plano próximo). Luzes direcionais
+        # alcançam todos os tiles; luzes inteiramente atrás do plano próximo, nenhum.
+        tiles_x = -(-width // tile_size)
+        tiles_y = -(-height // tile_size)
+        tiles = np.ones((tiles_y, tiles_x, len(lights)), dtype=bool)
+
+        for k, light in enumerate(lights):
+            if light["type"] != "point":
+                continue
+            tiles[:, :, k] = False
+
+            x, y, z = light["location"]
+            radius = light["radius"]
+            distance = -z
+            if distance + radius <= near:
+                continue
+
+            inverse = 1 / np.array([max(distance - radius, near), distance + radius])
+            x_ndc = np.outer([x - radius, x + radius], inverse) * projection[0, 0]
+            y_ndc = np.outer([y - radius, y + radius], inverse) * projection[1, 1]
+
+            # Do espaço normalizado para os tiles (o eixo y da tela aponta para baixo)
+            x0 = (x_ndc.min() + 1) * width / 2
+            x1 = (x_ndc.max() + 1) * width / 2
+            y0 = (1 - y_ndc.max()) * height / 2
+            y1 = (1 - y_ndc.min()) * height / 2
+            tx0, tx1 = max(int(x0 // tile_size), 0), min(int(x1 // tile_size), tiles_x - 1)
+            ty0, ty1 = max(int(y0 // tile_size), 0), min(int(y1 // tile_size), tiles_y - 1)
+            if tx0 <= tx1 and ty0 <= ty1:
+                tiles[ty0:ty1 + 1, tx0:tx1 + 1, k] = True
+
+        return tiles
+
+    @staticmethod
+    def face_normals(triangles):
+        """Normais unitárias dos triângulos (3 linhas por triângulo), repetidas nos vértices."""
+        # Vértices em sentido anti-horário geram a normal para fora (regra da mão direita)
+        a, b, c = triangles[0::3, :3], triangles[1::3, :3], triangles[2::3, :3]
+        normals = Lighting.normalize(np.cross(b - a, c - a))
+        return np.repeat(normals, 3, axis=0)
+
+    @staticmethod
+    def normalize(vectors):
+        """Normaliza as linhas de uma matriz N x 3 (vetores nulos continuam nulos)."""
+        length = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return np.divide(vectors, length, out=np.zeros_like(vectors), where=length > 0)
+
+    @staticmethod
+    def shade(positions, normals, colors, lights, diffuse=None):
+        """Cor RGB (entre 0 e 1) de cada ponto com a equação de iluminação do X3D."""
+        # https://www.web3d.org/specifications/X3Dv4/ISO-IEC19775-1v4-IS/Part01/components/lighting.html#Lightingequations
+        # positions e normals são N x 3 no sistema da câmera (observador na origem). Se
+        # diffuse (N x 3) for informado ele substitui a cor difusa do material, como as
+        # cores por vértice do nó Color.
+        # I = emissiva + soma das luzes de atenuação * cor da luz * (ambiente + difusa + especular)
+        normals = Lighting.normalize(normals)
+        view = Lighting.normalize(-positions)
+
+        if diffuse is None:
+            diffuse = np.asarray(colors["diffuseColor"], dtype=np.float64)
+        specular = np.asarray(colors["specularColor"], dtype=np.float64)
+        shininess = 128 * colors["shininess"]
+        ambient = colors.get("ambientIntensity", 0.2)
+
+        result = np.zeros((len(positions), 3))
+        result += colors["emissiveColor"]
+
+        for light in lights:
+            if light["type"] == "directional":
+                to_light = np.broadcast_to(-light["direction"], positions.shape)
+                attenuation = np.ones(len(positions))
+            else:
+                to_light = light["location"] - positions
+                distance = np.linalg.norm(to_light, axis=1)
+                to_light = Lighting.normalize(to_light)
+                a0, a1, a2 = light["attenuation"]
+                attenuation = 1 / np.maximum(a0 + a1*distance + a2*distance**2, 1)
+                attenuation[distance > light["radius"]] = 0
+
+            n_dot_l = np.maximum(np.einsum("ij,ij->i", normals, to_light), 0)
+            half = Lighting.normalize(to_light + view)
+            n_dot_h = np.maximum(np.einsum("ij,ij->i", normals, half), 0)
+            highlight = np.where(n_dot_l > 0, n_dot_h ** shininess, 0)
+
+            term = (light["ambientIntensity"] * ambient * diffuse +
+                    light["intensity"] * n_dot_l[:, np.newaxis] * diffuse +
+                    light["intensity"] * highlight[:, np.newaxis] * specular)
+            result += (attenuation[:, np.newaxis] * light["color"]) * term
+
+        return np.clip(result, 0, 1)
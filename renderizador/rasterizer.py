@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# pylint: disable=invalid-name
+
+"""
+Rasterizador vetorizado de triângulos.
+
+Desenvolvido por: <JOÃO LUCAS CADORNIGA>
+Disciplina: Computação Gráfica
+Data: <10/08/2024>
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool, shared_memory
+
+import numpy as np  # Biblioteca do Numpy
+
+from texture import TextureHandler
+from lighting import Lighting
+
+
+class Rasterizer:
+    """Rasteriza triângulos avaliando a caixa envolvente inteira com operações do Numpy."""
+
+    @staticmethod
+    def draw_triangles(points, color_buffer, z_buffer, colors,
+                       vertexColors=None, vertexTex=None, tile_size=0, tiles=None,
+                       mipmaps=None, vertexNormals=None, vertexPositions=None, lights=None,
+                       gbuffer=None, material=0, light_tiles=None):
+        """Rasteriza uma lista de triângulos no color_buffer e z_buffer informados."""
+        # Mesma regra de cobertura do caminho escalar: centro do pixel e teste >= 0 nas
+        # três arestas. Em vez de testar pixel a pixel, todos os pixels da caixa envolvente
+        # de cada triângulo são avaliados de uma vez como matrizes. Se tiles for informado
+        # (conjunto com o canto (x0, y0) de cada tile), só esses tiles são desenhados.
+        # Sem mipmaps informados a textura usada é a última gerada no TextureHandler.
+        # Com vertexNormals e vertexPositions (sistema da câmera) cada fragmento é iluminado
+        # pelas luzes informadas, usando vertexColors (se houver) como cor difusa.
+        # Com gbuffer (normal, albedo e material) os fragmentos visíveis gravam o índice do
+        # material; se ele não for 0 (sem iluminação) são gravadas a normal e a cor difusa
+        # no lugar da cor, e a iluminação fica para depois (GL.lighting_pass).
+        # light_tiles (Lighting.bin_lights com o mesmo tile_size) limita as luzes avaliadas
+        # em cada tile às que o alcançam.
+
+        points = np.asarray(points, dtype=np.float64)
+        if vertexColors is not None:
+            vertexColors = np.asarray(vertexColors, dtype=np.float64)
+        if vertexTex is not None:
+            vertexTex = np.asarray(vertexTex, dtype=np.float64)
+        lighting = None
+        if vertexNormals is not None:
+            if vertexPositions is not None:
+                vertexPositions = np.asarray(vertexPositions, dtype=np.float64)
+            lighting = (np.asarray(vertexNormals, dtype=np.float64), vertexPositions, lights)
+
+        color = np.array([int(255 * c) for c in colors['emissiveColor']])
+        transparency = float(colors.get('transparency', 1))
+
+        height, width = z_buffer.shape
+        if tile_size:
+            bins = Rasterizer.bin_triangles(points, width, height, tile_size)
+            if tiles is not None:
+                bins = [(region, triangles) for region, triangles in bins
+                        if region[:2] in tiles]
+        else:
+            bins = [((0, 0, width, height), range(len(points) // 3))]
+
+        # Triângulos 2D chegam com z = 0, o que gera divisões por zero na interpolação
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for region, triangles in bins:
+                x0, y0, x1, y1 = region
+
+                # Fatias (views) do tile: tudo que o tile toca fica junto na cache
+                color_tile = color_buffer[y0:y1, x0:x1]
+                z_tile = z_buffer[y0:y1, x0:x1]
+                g_tile = None
+                if gbuffer is not None:
+                    g_tile = [buffer[y0:y1, x0:x1] for buffer in gbuffer]
+
+                tile_lighting = lighting
+                if lighting is not None and light_tiles is not None and tile_size:
+                    tile_lights = light_tiles[y0 // tile_size, x0 // tile_size]
+                    tile_lighting = lighting[:2] + ([lights[k] for k in
+                                                     np.flatnonzero(tile_lights)],)
+
+                for t in triangles:
+                    Rasterizer._triangle(points, 3 * t, region, color_tile, z_tile,
+                                         color, transparency, vertexColors, vertexTex, mipmaps,
+                                         colors, tile_lighting, g_tile, material)
+
+    @staticmethod
+    def bin_triangles(points, width, height, tile_size):
+        """Distribui os triângulos nos tiles da tela tocados por suas caixas envolventes."""
+        # Retorna uma lista de (região do tile, índices dos triângulos), mantendo a ordem
+        # original dos triângulos dentro de cada tile. Tiles vazios não aparecem na lista.
+        triangles = np.asarray(points, dtype=np.float64).reshape(-1, 3, 3)
+        if len(triangles) == 0:
+            return []
+
+        x_min, x_max, y_min, y_max = Rasterizer._bounding_boxes(triangles, width, height)
+        valid = (x_min <= x_max) & (y_min <= y_max)
+
+        tiles_x = -(-width // tile_size)
+        tx0, tx1 = x_min // tile_size, x_max // tile_size
+        ty0, ty1 = y_min // tile_size, y_max // tile_size
+
+        # Quantidade de tiles por triângulo
+        span_x = np.where(valid, tx1 - tx0 + 1, 0)
+        span_y = np.where(valid, ty1 - ty0 + 1, 0)
+        counts = span_x * span_y
+        total = counts.sum()
+        if total == 0:
+            return []
+
+        # Expande os pares (tile, triângulo) sem laços em Python
+        tri_ids = np.repeat(np.arange(len(triangles)), counts)
+        offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        tile_x = tx0[tri_ids] + offset % span_x[tri_ids]
+        tile_y = ty0[tri_ids] + offset // span_x[tri_ids]
+        tile_ids = tile_y * tiles_x + tile_x
+
+        # Ordenação estável para preservar a ordem de desenho dentro do tile
+        order = np.argsort(tile_ids, kind='stable')
+        tile_ids, tri_ids = tile_ids[order], tri_ids[order]
+        starts = np.flatnonzero(np.r_[True, tile_ids[1:] != tile_ids[:-1]])
+        ends = np.r_[starts[1:], len(tile_ids)]
+
+        bins = []
+        for start, end in zip(starts, ends):
+            ty, tx = divmod(int(tile_ids[start]), tiles_x)
+            region = (tx * tile_size, ty * tile_size,
+                      min((tx + 1) * tile_size, width), min((ty + 1) * tile_size, height))
+            bins.append((region, tri_ids[start:end].tolist()))
+        return bins
+
+    @staticmethod
+    def _bounding_boxes(triangles, width, height):
+        """Caixas envolventes (em pixels, inclusivas) dos triângulos, limitadas à tela."""
+        # Mesmo arredondamento do caminho escalar: int() trunca em direção ao zero.
+        # Triângulos inválidos (NaN) ficam com caixas vazias.
+        lo = np.nan_to_num(triangles[:, :, :2].min(axis=1), nan=np.inf)
+        hi = np.nan_to_num(triangles[:, :, :2].max(axis=1), nan=-np.inf)
+        lo = np.trunc(np.clip(lo, -1, max(width, height))).astype(int)
+        hi = np.trunc(np.clip(hi, -1, max(width, height))).astype(int)
+
+        x_min = np.maximum(lo[:, 0], 0)
+        x_max = np.minimum(hi[:, 0], width - 1)
+        y_min = np.maximum(lo[:, 1], 0)
+        y_max = np.minimum(hi[:, 1], height - 1)
+        return x_min, x_max, y_min, y_max
+
+    @staticmethod
+    def _triangle(points, i, region, color_buffer, z_buffer, color, transparency,
+                  vertexColors, vertexTex, mipmaps=None, colors=None, lighting=None,
+                  gbuffer=None, material=0):
+        """Rasteriza o triângulo que começa no vértice i dentro da região (tile) informada."""
+        # color_buffer e z_buffer são as fatias da região, que começa em (rx0, ry0)
+        rx0, ry0, rx1, ry1 = region
+
+        (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) = points[i:i+3].tolist()
+
+        # Caixa envolvente já limitada à região
+        x_min = max(int(min(x1, x2, x3)), rx0)
+        x_max = min(int(max(x1, x2, x3)), rx1 - 1)
+        y_min = max(int(min(y1, y2, y3)), ry0)
+        y_max = min(int(max(y1, y2, y3)), ry1 - 1)
+        if x_min > x_max or y_min > y_max:
+            return
+
+        # Centros dos pixels da caixa envolvente
+        x = np.arange(x_min, x_max + 1, dtype=np.float64)[np.newaxis, :] + 0.5
+        y = np.arange(y_min, y_max + 1, dtype=np.float64)[:, np.newaxis] + 0.5
+
+        inside = Rasterizer._edge(x, y, x1, y1, x2, y2)
+        inside &= Rasterizer._edge(x, y, x2, y2, x3, y3)
+        inside &= Rasterizer._edge(x, y, x3, y3, x1, y1)
+
+        rows, cols = np.nonzero(inside)
+        if rows.size == 0:
+            return
+
+        py = rows + y_min
+        px = cols + x_min
+        vertices = (x1, y1, x2, y2, x3, y3)
+
+        # Interpolação baricêntrica e Z perspectivamente correto
+        alpha, beta, gamma = Rasterizer._barycentric(vertices, px + 0.5, py + 0.5)
+        z = 1/(alpha/z1 + beta/z2 + gamma/z3)
+
+        # Teste de profundidade (índices locais à região)
+        ly = py - ry0
+        lx = px - rx0
+        visible = z_buffer[ly, lx] > z
+        if not visible.any():
+            return
+
+        py, px, ly, lx, z = py[visible], px[visible], ly[visible], lx[visible], z[visible]
+        alpha, beta, gamma = alpha[visible], beta[visible], gamma[visible]
+
+        z_buffer[ly, lx] = z
+
+        if gbuffer is not None:
+            normal_buffer, albedo_buffer, material_buffer = gbuffer
+            material_buffer[ly, lx] = material
+            if material:
+                depths = (z1, z2, z3)
+                normal_buffer[ly, lx] = Rasterizer._interpolate(lighting[0][i:i+3], alpha, beta,
+                                                                gamma, depths, z)
+                if vertexColors is not None:
+                    albedo_buffer[ly, lx] = Rasterizer._interpolate(vertexColors[i:i+3], alpha,
+                                                                    beta, gamma, depths, z)
+                else:
+                    albedo_buffer[ly, lx] = colors["diffuseColor"]
+                return
+
+        last_color = color_buffer[ly, lx] * transparency
+
+        if lighting is not None:
+            vertexNormals, vertexPositions, lights = lighting
+            depths = (z1, z2, z3)
+
+            normal = Rasterizer._interpolate(vertexNormals[i:i+3], alpha, beta, gamma, depths, z)
+            position = Rasterizer._interpolate(vertexPositions[i:i+3], alpha, beta, gamma,
+                                               depths, z)
+            diffuse = None
+            if vertexColors is not None:
+                diffuse = Rasterizer._interpolate(vertexColors[i:i+3], alpha, beta, gamma,
+                                                  depths, z)
+
+            rgb = Lighting.shade(position, normal, colors, lights, diffuse)
+            pointColor = (rgb * 255).astype(int)
+
+            color_buffer[ly, lx] = pointColor * (1 - transparency) + last_color
+        elif vertexColors is not None:
+            rgb = Rasterizer._interpolate(vertexColors[i:i+3], alpha, beta, gamma, (z1, z2, z3), z)
+
+            pointColor = (rgb * 255).astype(int)
+
+            color_buffer[ly, lx] = pointColor * (1 - transparency) + last_color
+        elif vertexTex is not None:
+            uv1, uv2, uv3 = vertexTex[i:i+3]
+
+            u, v = TextureHandler.calculate_uv(uv1, uv2, uv3, z1, z2, z3, z, alpha, beta, gamma)
+
+            # Derivadas das coordenadas UV na tela, calculadas analiticamente
+            du_dx, dv_dx, du_dy, dv_dy = Rasterizer._uv_gradients(vertices, (z1, z2, z3),
+                                                                  (uv1, uv2, uv3), u, v, z)
+
+            lod = TextureHandler.calculate_lod(du_dx, dv_dx, du_dy, dv_dy)
+            pointTex = TextureHandler.sample(u, v, lod, mipmaps)
+
+            color_buffer[ly, lx] = pointTex * (1 - transparency) + last_color
+        else:
+            color_buffer[ly, lx] = color * (1 - transparency) + last_color
+
+    @staticmethod
+    def _interpolate(values, alpha, beta, gamma, depths, z):
+        """Interpola atributos dos 3 vértices nos fragmentos com correção de perspectiva."""
+        v1, v2, v3 = values
+        z1, z2, z3 = depths
+        return (alpha[:, np.newaxis] * v1 / z1 +
+                beta[:, np.newaxis] * v2 / z2 +
+                gamma[:, np.newaxis] * v3 / z3) * z[:, np.newaxis]
+
+    @staticmethod
+    def _uv_gradients(vertices, depths, uvs, u, v, z):
+        """Derivadas das coordenadas UV na tela com correção de perspectiva."""
+        # As baricêntricas variam linearmente na tela, então os numeradores U e V e o
+        # denominador W = 1/z da interpolação (u = U/W e v = 1 - V/W) também. Pela regra do
+        # quociente, du/dx = (dU/dx - u dW/dx) z, com as derivadas dos termos lineares
+        # constantes no triângulo (calculadas uma única vez).
+        x1, y1, x2, y2, x3, y3 = vertices
+        area = ((x2 - x1)*(y3 - y1) - (x3 - x1)*(y2 - y1)) / 2
+
+        # Derivadas de alpha, beta e gamma em x e em y
+        d_alpha = np.array([(y2 - y3), (x3 - x2)]) / (2 * area)
+        d_beta = np.array([(y3 - y1), (x1 - x3)]) / (2 * area)
+        d_gamma = -d_alpha - d_beta
+
+        w = 1 / np.asarray(depths, dtype=np.float64)
+        uvs = np.asarray(uvs, dtype=np.float64)
+
+        d_bary = np.stack((d_alpha, d_beta, d_gamma))  # 3 vértices x (x, y)
+        dW = w @ d_bary
+        dU = (uvs[:, 0] * w) @ d_bary
+        dV = (uvs[:, 1] * w) @ d_bary
+
+        du_dx = (dU[0] - u * dW[0]) * z
+        du_dy = (dU[1] - u * dW[1]) * z
+        dv_dx = -(dV[0] - (1 - v) * dW[0]) * z
+        dv_dy = -(dV[1] - (1 - v) * dW[1]) * z
+
+        return du_dx, dv_dx, du_dy, dv_dy
+
+    @staticmethod
+    def _edge(x, y, x0, y0, x1, y1):
+        """Formula da reta normal avaliada em matrizes de pontos."""
+        return (x - x0)*(y1 - y0) - (y - y0)*(x1 - x0) >= 0
+
+    @staticmethod
+    def _barycentric(vertices, x, y):
+        """Coordenadas baricêntricas de matrizes de pontos em um triângulo."""
+        x1, y1, x2, y2, x3, y3 = vertices
+
+        A1 = (x*(y2 - y3) + x2*(y3 - y) + x3*(y - y2)) / 2
+        A2 = (x1*(y - y3) + x*(y3 - y1) + x3*(y1 - y)) / 2
+        A3 = (x1*(y2 - y) + x2*(y - y1) + x*(y1 - y2)) / 2
+        Atotal = A1 + A2 + A3
+
+        alpha = A1 / Atotal
+        beta = A2 / Atotal
+        gamma = 1 - alpha - beta
+
+        return alpha, beta, gamma
+
+
+class TilePool:
+    """Rasteriza grupos disjuntos de tiles da tela em processos separados."""
+
+    worker = {}  # buffers do processo trabalhador (preenchido por _attach)
+
+    def __init__(self, workers, height, width):
+        """Cria o framebuffer e o z-buffer em memória compartilhada e inicia os processos."""
+        # Os processos escrevem direto nos buffers compartilhados: só os triângulos são
+        # enviados (pickle) para eles, os pixels nunca.
+        self.workers = workers
+        self.height = height
+        self.width = width
+
+        self.color_memory = shared_memory.SharedMemory(create=True, size=height * width * 3)
+        self.depth_memory = shared_memory.SharedMemory(create=True, size=height * width * 8)
+        self.color_buffer = np.ndarray((height, width, 3), dtype=np.uint8,
+                                       buffer=self.color_memory.buf)
+        self.z_buffer = np.ndarray((height, width), dtype=np.float64,
+                                   buffer=self.depth_memory.buf)
+
+        self.pool = Pool(workers, initializer=TilePool._attach,
+                         initargs=(self.color_memory.name, self.depth_memory.name, height, width))
+
+    def draw(self, commands, tile_size):
+        """Rasteriza os comandos de desenho do quadro e espera todos os processos terminarem."""
+        # Mais grupos que processos para equilibrar a carga entre regiões cheias e vazias
+        jobs = TilePool.split(commands, self.width, self.height, tile_size, 2 * self.workers)
+        self.pool.map(TilePool._work, [(job, tiles, tile_size) for job, tiles in jobs])
+
+    def close(self):
+        """Encerra os processos e libera a memória compartilhada."""
+        self.pool.close()
+        self.pool.join()
+        self.color_buffer = self.z_buffer = None
+        for memory in (self.color_memory, self.depth_memory):
+            memory.close()
+            memory.unlink()
+
+    @staticmethod
+    def split(commands, width, height, tile_size, groups):
+        """Divide os comandos de desenho entre grupos disjuntos de tiles."""
+        # Os tiles são distribuídos intercalados entre os grupos e cada grupo recebe, por
+        # comando, só os triângulos que tocam seus tiles, na ordem original de desenho.
+        # Retorna uma lista de (comandos, conjunto de tiles) sem os grupos vazios.
+        tiles_x = -(-width // tile_size)
+        jobs = [([], set()) for _ in range(groups)]
+
+        for command in commands:
+            points = command["points"]
+            parts = [[] for _ in range(groups)]
+            for region, triangles in Rasterizer.bin_triangles(points, width, height, tile_size):
+                x0, y0 = region[:2]
+                group = ((y0 // tile_size) * tiles_x + x0 // tile_size) % groups
+                parts[group].append(triangles)
+                jobs[group][1].add((x0, y0))
+
+            for group, part in enumerate(parts):
+                if not part:
+                    continue
+                triangles = np.unique(np.concatenate(part))
+                rows = (3 * triangles[:, np.newaxis] + np.arange(3)).ravel()
+                job = dict(command, points=points[rows])
+                for attribute in ("vertexColors", "vertexTex", "vertexNormals", "vertexPositions"):
+                    if command.get(attribute) is not None:
+                        job[attribute] = command[attribute][rows]
+                jobs[group][0].append(job)
+
+        return [job for job in jobs if job[0]]
+
+    @staticmethod
+    def run(commands, color_buffer, z_buffer, tile_size, tiles=None):
+        """Rasteriza os comandos, em ordem, nos buffers informados."""
+        for command in commands:
+            mipmaps = command.get("mipmaps")
+            if mipmaps is None and command["texture"] is not None:
+                mipmaps = TextureHandler.generate_mipmaps(command["texture"])
+            Rasterizer.draw_triangles(command["points"], color_buffer, z_buffer,
+                                      command["colors"], command["vertexColors"],
+                                      command["vertexTex"], tile_size=tile_size, tiles=tiles,
+                                      mipmaps=mipmaps, vertexNormals=command.get("vertexNormals"),
+                                      vertexPositions=command.get("vertexPositions"),
+                                      lights=command.get("lights"),
+                                      light_tiles=command.get("light_tiles"))
+
+    @staticmethod
+    def _attach(color_name, depth_name, height, width):
+        """Abre os buffers compartilhados no processo trabalhador."""
+        color_memory = shared_memory.SharedMemory(name=color_name)
+        depth_memory = shared_memory.SharedMemory(name=depth_name)
+        TilePool.worker = {
+            "memory": (color_memory, depth_memory),
+            "color_buffer": np.ndarray((height, width, 3), dtype=np.uint8,
+                                       buffer=color_memory.buf),
+            "z_buffer": np.ndarray((height, width), dtype=np.float64, buffer=depth_memory.buf),
+        }
+
+    @staticmethod
+    def _work(job):
+        """Rasteriza, no processo trabalhador, os comandos de um grupo de tiles."""
+        commands, tiles, tile_size = job
+        TilePool.run(commands, TilePool.worker["color_buffer"], TilePool.worker["z_buffer"],
+                     tile_size, tiles)
+
+
+class TileThreadPool:
+    """Rasteriza grupos disjuntos de tiles em threads, sem criar processos."""
+
+    def __init__(self, threads, height, width):
+        """Cria os buffers e as threads."""
+        # As operações grandes do Numpy liberam o GIL, então tiles diferentes podem ser
+        # rasterizados ao mesmo tempo. Cada thread escreve só nos seus tiles, sem disputa
+        # no teste de profundidade.
+        self.threads = threads
+        self.height = height
+        self.width = width
+
+        self.color_buffer = np.zeros((height, width, 3), dtype=np.uint8)
+        self.z_buffer = np.full((height, width), np.inf)
+
+        self.executor = ThreadPoolExecutor(threads)
+
+    def draw(self, commands, tile_size):
+        """Rasteriza os comandos de desenho do quadro e espera todas as threads terminarem."""
+        # Os mipmaps são gerados uma vez aqui e passados explicitamente, já que o
+        # TextureHandler guarda só a última textura gerada
+        for command in commands:
+            if command["texture"] is not None and command.get("mipmaps") is None:
+                command["mipmaps"] = TextureHandler.generate_mipmaps(command["texture"])
+
+        jobs = TilePool.split(commands, self.width, self.height, tile_size, 2 * self.threads)
+        futures = [self.executor.submit(TilePool.run, job, self.color_buffer, self.z_buffer,
+                                        tile_size, tiles) for job, tiles in jobs]
+        for future in futures:
+            future.result()  # propaga exceções das threads
+
+    def close(self):
+        """Encerra as threads."""
+        self.executor.shutdown()
@@ -101,6 +101,12 @@ class Renderizador:
         # Limpa o frame buffers atual
         gpu.GPU.clear_buffer()
 
+        # Limpa o framebuffer super amostrado e o z-buffer da biblioteca gráfica
+        gl.GL.clear_sample_buffers()
+
+        # Zera os contadores do quadro (triângulos descartados, etc.)
+        gl.GL.reset_stats()
+
         # Recursos que podem ser úteis:
         # Define o valor do pixel no framebuffer: draw_pixel(coord, mode, data)
         # Retorna o valor do pixel no framebuffer: read_pixel(coord, mode)
@@ -113,6 +119,9 @@ class Renderizador:
         # ao final da renderização de um frame. Como por exemplo, executar
         # downscaling da imagem.
 
+        # Faz o downscaling do framebuffer super amostrado uma única vez por quadro
+        gl.GL.resolve()
+
         # Método para a troca dos buffers (NÃO IMPLEMENTADO)
         # Esse método será utilizado na fase de implementação de animações
         gpu.GPU.swap_buffers()
@@ -128,6 +137,7 @@ class Renderizador:
         x3d.X3D.renderer["Viewpoint"] = gl.GL.viewpoint
         x3d.X3D.renderer["Transform_in"] = gl.GL.transform_in
         x3d.X3D.renderer["Transform_out"] = gl.GL.transform_out
+        x3d.X3D.renderer["Transform_visible"] = gl.GL.transform_visible
         x3d.X3D.renderer["TriangleStripSet"] = gl.GL.triangleStripSet
         x3d.X3D.renderer["IndexedTriangleStripSet"] = gl.GL.indexedTriangleStripSet
         x3d.X3D.renderer["IndexedFaceSet"] = gl.GL.indexedFaceSet
@@ -161,6 +171,10 @@ class Renderizador:
         parser.add_argument("-g", "--graph", help="imprime o grafo de cena", action='store_true')
         parser.add_argument("-p", "--pause", help="começa simulação em pausa", action='store_true')
         parser.add_argument("-q", "--quiet", help="não exibe janela", action='store_true')
+        parser.add_argument("-j", "--workers", help="processos para rasterizar em paralelo", type=int)
+        parser.add_argument("-t", "--threads", help="threads para rasterizar em paralelo", type=int)
+        parser.add_argument("-s", "--shading", help="iluminação por vértice ou por fragmento",
+                            choices=["gouraud", "phong", "deferred"])
         args = parser.parse_args() # parse the arguments
         if args.input:
             self.x3d_file = args.input
@@ -170,6 +184,12 @@ class Renderizador:
             self.width = args.width
         if args.height:
             self.height = args.height
+        if args.workers:
+            gl.GL.workers = args.workers
+        if args.threads:
+            gl.GL.threads = args.threads
+        if args.shading:
+            gl.GL.shading = args.shading
 
         path = os.path.dirname(os.path.abspath(self.x3d_file))
 
@@ -1,16 +1,21 @@
+import hashlib
+
 import numpy as np
 
 
 class TextureHandler:
 
     mipmaps = []
+    pyramids = {}  # cached mipmap chains, see generate_mipmaps
+    max_pyramids = 16
 
     @staticmethod
     def get_texture(
-        u, v, u_up, v_up, u_right, v_right
+        u, v, u_up, v_up, u_right, v_right, mipmaps=None
     ):
-        #Config
-        mipmaps = TextureHandler.mipmaps
+        #Config (explicit mipmaps let several threads sample different textures)
+        if mipmaps is None:
+            mipmaps = TextureHandler.mipmaps
 
         # Calculate the partial derivatives
         du_dx = u_right - u
@@ -46,6 +51,81 @@ class TextureHandler:
         # Perform linear interpolation between the two mipmap levels
         return (1 - D_frac) * sample_D + D_frac * sample_D_plus_1
 
+    @staticmethod
+    def calculate_lod(du_dx, dv_dx, du_dy, dv_dy):
+        # Batched version of the level of detail in get_texture: log2 of the largest
+        # UV footprint along x and y, from screen space UV derivatives (arrays)
+        L = np.maximum(
+            np.sqrt(du_dx**2 + dv_dx**2),
+            np.sqrt(du_dy**2 + dv_dy**2)
+        )
+        with np.errstate(divide='ignore'):
+            return np.log2(L)
+
+    @staticmethod
+    def sample(u, v, lod, mipmaps=None):
+        # Batched trilinear sampling: one u, v and lod per fragment, returns (N, 3) colors.
+        # Same level selection and filtering as get_texture, gathered per mip level.
+        if mipmaps is None:
+            mipmaps = TextureHandler.mipmaps
+
+        u = np.asarray(u, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        lod = np.asarray(lod, dtype=np.float64)
+
+        # A zero footprint (constant UVs) has no finite level: use the base texture
+        lod = np.where(np.isfinite(lod), lod, 0)
+
+        D_floor = np.floor(lod)
+        D_frac = (lod - D_floor)[:, np.newaxis]  # Fractional part for interpolation
+
+        # Ensure valid mipmap level
+        D_floor = np.clip(D_floor, 0, len(mipmaps) - 1).astype(int)
+        D_ceil = np.clip(D_floor + 1, 0, len(mipmaps) - 1)
+
+        sample_D = TextureHandler._sampleLevels(u, v, D_floor, mipmaps)
+        sample_D_plus_1 = TextureHandler._sampleLevels(u, v, D_ceil, mipmaps)
+
+        # Perform linear interpolation between the two mipmap levels
+        return (1 - D_frac) * sample_D + D_frac * sample_D_plus_1
+
+    @staticmethod
+    def _sampleLevels(u, v, levels, mipmaps):
+        # Bilinear samples where each fragment reads its own mip level
+        samples = np.empty((len(u), 3))
+        for level in np.unique(levels):
+            selected = levels == level
+            texture = mipmaps[level]
+            samples[selected] = TextureHandler._bilinearFilterBatch(
+                u[selected] * texture.shape[1], v[selected] * texture.shape[0], texture)
+        return samples
+
+    @staticmethod
+    def _bilinearFilterBatch(tex_x, tex_y, texture):
+        # Array version of _bilinearFilter. Indices wrap like Python indexing does for
+        # negative values (and repeat the texture past the end instead of failing)
+        x0 = np.floor(tex_x).astype(int)
+        y0 = np.floor(tex_y).astype(int)
+        x1 = np.minimum(x0 + 1, texture.shape[1] - 1)
+        y1 = np.minimum(y0 + 1, texture.shape[0] - 1)
+
+        # Steps
+        u_step = (tex_x - x0)[:, np.newaxis]
+        v_step = (tex_y - y0)[:, np.newaxis]
+
+        x0, x1 = x0 % texture.shape[0], x1 % texture.shape[0]
+        y0, y1 = y0 % texture.shape[1], y1 % texture.shape[1]
+
+        top_left = texture[x0, y0]
+        top_right = texture[x1, y0]
+        bottom_left = texture[x0, y1]
+        bottom_right = texture[x1, y1]
+
+        top_interp = (1 - u_step) * top_left + u_step * top_right
+        bottom_interp = (1 - u_step) * bottom_left + u_step * bottom_right
+
+        return (1 - v_step) * top_interp + v_step * bottom_interp
+
     @staticmethod
     def calculate_uv(
         uv1, uv2, uv3,
@@ -79,24 +159,53 @@ class TextureHandler:
         return (1 - v_step) * top_interp + v_step * bottom_interp
     
     @staticmethod
-    def generate_mipmaps(texture):
+    def generate_mipmaps(texture, key=None):
+        # Pyramids are cached, so each texture is reduced once and not on every draw call.
+        # Without a key the texture contents identify it (reloading the same file hits).
+        texture = np.ascontiguousarray(texture)
+        if key is None:
+            key = (texture.shape, texture.dtype.str,
+                   hashlib.blake2b(texture, digest_size=16).digest())
+
+        mipmaps = TextureHandler.pyramids.get(key)
+        if mipmaps is None:
+            mipmaps = TextureHandler.build_mipmaps(texture)
+
+            # Keep only the most recent pyramids (dicts keep insertion order)
+            if len(TextureHandler.pyramids) >= TextureHandler.max_pyramids:
+                del TextureHandler.pyramids[next(iter(TextureHandler.pyramids))]
+            TextureHandler.pyramids[key] = mipmaps
+
+        TextureHandler.mipmaps = mipmaps
+        return mipmaps
+
+    @staticmethod
+    def build_mipmaps(texture):
+        # Level 0 is the texture itself, the others are float32 2x2 box reductions.
+        # Unlike generate_mipmaps this neither caches nor selects the pyramid.
         mipmaps = [texture]
         current_level = texture
 
         # Keep reducing size by half until reaching 1x1
         while current_level.shape[0] > 1 or current_level.shape[1] > 1:
-            # Downsample the texture by averaging neighboring texels
-            new_width = max(1, current_level.shape[1] // 2)
-            new_height = max(1, current_level.shape[0] // 2)
-
-            new_level = np.zeros((new_height, new_width, 3))
+            current_level = TextureHandler._halve(TextureHandler._halve(current_level, 0), 1)
+            mipmaps.append(current_level)
 
-            for y in range(new_height):
-                for x in range(new_width):
-                    # Average the 4 texels from the previous mipmap level
-                    new_level[x, y] = np.mean(current_level[2*x:2*x + 2, 2*y:2*y + 2], axis=(0, 1))
+        return mipmaps
 
-            mipmaps.append(new_level)
-            current_level = new_level
-
-        TextureHandler.mipmaps = mipmaps
\ No newline at end of file
+    @staticmethod
+    def _halve(level, axis):
+        # Average texel pairs along one axis; with an odd size the last output texel
+        # averages the last three texels, so no row or column is dropped
+        size = level.shape[axis]
+        if size == 1:
+            return level
+
+        level = np.moveaxis(level, axis, 0)
+        even = level[:size - size % 2]
+        halved = np.add(even[0::2], even[1::2], dtype=np.float32)
+        if size % 2:
+            halved[-1] = (halved[-1] + level[-1]) * np.float32(2/3)
+        halved *= np.float32(0.5)
+
+        return np.ascontiguousarray(np.moveaxis(halved, 0, axis))
@@ -17,6 +17,7 @@ import xml.etree.ElementTree
 # Outras
 import re
 import math
+import numpy as np
 
 # Métodos de Apoio
 
@@ -31,7 +32,9 @@ def get_colors(appearance):
         "emissiveColor": [0.0, 0.0, 0.0],  # Valor padrão
         "specularColor": [0.0, 0.0, 0.0],  # Valor padrão
         "shininess": 0.2,  # Valor padrão
-        "transparency": 0.0  # Valor padrão
+        "transparency": 0.0,  # Valor padrão
+        "ambientIntensity": 0.2,  # Valor padrão
+        "lighting": False  # Sem Material a geometria não é iluminada
     }
     if appearance and appearance.material:
         colors["diffuseColor"] = appearance.material.diffuseColor
@@ -39,9 +42,134 @@ def get_colors(appearance):
         colors["specularColor"] = appearance.material.specularColor
         colors["shininess"] = appearance.material.shininess
         colors["transparency"] = appearance.material.transparency
+        colors["ambientIntensity"] = appearance.material.ambientIntensity
+        colors["lighting"] = True
 
     return colors
 
+def merge_bounds(boxes):
+    """Une caixas envolventes ([x, y, z] mínimo, [x, y, z] máximo) em uma só."""
+    if not boxes:
+        return None
+    lower = [min(box[0][i] for box in boxes) for i in range(3)]
+    upper = [max(box[1][i] for box in boxes) for i in range(3)]
+    return lower, upper
+
+def transform_bounds(box, translation, rotation, scale):
+    """Leva uma caixa envolvente para o sistema do pai aplicando T @ R @ S (como o GL)."""
+    # Mesma rotação por quatérnio usada pelo GL, assim a caixa acompanha a geometria
+    x, y, z, theta = rotation if rotation else [0, 0, 1, 0]
+    qr = math.cos(theta/2)
+    qx, qy, qz = (math.sin(theta/2) * axis for axis in (x, y, z))
+    R = [
+        [1 - 2*(qy**2 + qz**2), 2*(qx*qy - qz*qr), 2*(qx*qz + qy*qr)],
+        [2*(qx*qy + qz*qr), 1 - 2*(qx**2 + qz**2), 2*(qy*qz - qx*qr)],
+        [2*(qx*qz - qy*qr), 2*(qy*qz + qx*qr), 1 - 2*(qx**2 + qy**2)],
+    ]
+    scale = scale if scale else [1, 1, 1]
+    translation = translation if translation else [0, 0, 0]
+
+    # Centro transformado e meia diagonal projetada nos eixos (|R @ S| aplicado na metade)
+    center = [(box[0][i] + box[1][i]) / 2 for i in range(3)]
+    half = [(box[1][i] - box[0][i]) / 2 for i in range(3)]
+    new_center = [sum(R[i][j] * scale[j] * center[j] for j in range(3)) + translation[i]
+                  for i in range(3)]
+    new_half = [sum(abs(R[i][j] * scale[j]) * half[j] for j in range(3)) for i in range(3)]
+
+    return ([new_center[i] - new_half[i] for i in range(3)],
+            [new_center[i] + new_half[i] for i in range(3)])
+
+def point_bounds(point):
+    """Caixa envolvente de uma lista de pontos x, y, z sempre na ordem."""
+    if len(point) < 3:
+        return None
+    return ([min(point[i::3]) for i in range(3)],
+            [max(point[i::3]) for i in range(3)])
+
+def fan_triangles(index):
+    """Posições (dentro de index) dos vértices dos triângulos de polígonos separados por -1."""
+    # Cada polígono liga o primeiro ponto com os pares seguintes (leque): um polígono com
+    # n pontos começando na posição s vira os triângulos (s, s+k, s+k+1), k = 1 .. n-2
+    index = np.asarray(index, dtype=int)
+    ends = np.append(np.flatnonzero(index == -1), len(index))
+    starts = np.append(0, ends[:-1] + 1)
+    counts = np.maximum(ends - starts - 2, 0)
+
+    first = np.repeat(starts, counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    return np.stack([first, first + k, first + k + 1], axis=1).ravel()
+
+def strip_triangles(stripCount):
+    """Índices dos vértices dos triângulos de tiras seguidas com stripCount vértices cada."""
+    # O triângulo t da tira que começa no vértice s usa (s+t, s+t+1, s+t+2), trocando os
+    # dois últimos nos triângulos ímpares para manter a mesma orientação em toda a tira
+    counts = np.asarray(stripCount, dtype=int)
+    triangles = np.maximum(counts - 2, 0)
+    starts = np.cumsum(counts) - counts
+
+    t = np.arange(triangles.sum()) - np.repeat(np.cumsum(triangles) - triangles, triangles)
+    first = np.repeat(starts, triangles) + t
+    odd = t % 2
+    return np.stack([first, first + 1 + odd, first + 2 - odd], axis=1).ravel()
+
+def indexed_strip_triangles(index):
+    """Índices dos vértices dos triângulos de tiras separadas por -1."""
+    # Cada janela de 3 índices seguidos sem -1 é um triângulo; a paridade é contada a
+    # partir do início da tira e nos triângulos ímpares os dois primeiros são trocados
+    index = np.asarray(index, dtype=int)
+    if len(index) < 3:
+        return np.zeros(0, dtype=int)
+    windows = np.stack([index[:-2], index[1:-1], index[2:]], axis=1)
+    valid = (windows != -1).all(axis=1)
+
+    position = np.arange(len(index))
+    starts = np.maximum.accumulate(np.where(index == -1, position + 1, 0))
+    odd = ((position - starts)[:-2] % 2 == 1)[valid]
+
+    triangles = windows[valid]
+    triangles[odd] = triangles[odd][:, [1, 0, 2]]
+    return triangles.ravel()
+
+def mesh_normals(point, triangles, creaseAngle=0.0):
+    """Normais unitárias (float32) de cada vértice dos triângulos (3 por triângulo)."""
+    # Cada vértice recebe a média das normais, ponderadas pela área, das faces que usam o
+    # mesmo ponto e cujo ângulo com a face do próprio vértice não passa de creaseAngle
+    # (0 deixa as faces planas, pi suaviza tudo)
+    points = np.asarray(point, dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(triangles, dtype=int).reshape(-1, 3)
+    a, b, c = points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+    weighted = np.cross(b - a, c - a)  # comprimento igual ao dobro da área
+    length = np.linalg.norm(weighted, axis=1, keepdims=True)
+    unit = np.divide(weighted, length, out=np.zeros_like(weighted), where=length > 0)
+
+    corners = triangles.ravel()
+    if creaseAngle <= 0 or len(corners) == 0:
+        normals = np.repeat(unit, 3, axis=0)
+    elif creaseAngle >= math.pi:
+        sums = np.stack([np.bincount(corners, np.repeat(weighted[:, k], 3), len(points))
+                         for k in range(3)], axis=1)
+        normals = sums[corners]
+    else:
+        # Pares de cantos que usam o mesmo ponto (cantos agrupados por ponto)
+        order = np.argsort(corners, kind="stable")
+        _, starts, sizes = np.unique(corners[order], return_index=True, return_counts=True)
+        group_size = np.repeat(sizes, sizes)
+        group_start = np.repeat(starts, sizes)
+        first = np.repeat(np.arange(len(corners)), group_size)
+        offset = np.arange(len(first)) - np.repeat(np.cumsum(group_size) - group_size, group_size)
+        second = np.repeat(group_start, group_size) + offset
+
+        face, other = order[first] // 3, order[second] // 3
+        smooth = np.einsum("ij,ij->i", unit[face], unit[other]) >= math.cos(creaseAngle) - 1e-9
+        sums = np.stack([np.bincount(first[smooth], weighted[other[smooth], k], len(corners))
+                         for k in range(3)], axis=1)
+        normals = np.empty_like(sums)
+        normals[order] = sums
+
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, length, out=np.zeros_like(normals), where=length > 0)
+    return normals.astype(np.float32)
+
 
 # Leitores de Campos X3D
 
@@ -354,10 +482,32 @@ class X3DNode:
 
     def __init__(self, node=None):
         """Parse do nó X3D."""
+        self.parent = None  # nó acima deste no grafo de cena
+        self._bounds = None  # caixa envolvente em cache
+        self._bounds_dirty = True
         if node is not None and "DEF" in node.attrib:
             self.name = node.attrib["DEF"].strip()
             X3DNode.named_nodes[self.name] = self
 
+    def bounds(self):
+        """Caixa envolvente ([x, y, z] mínimo, [x, y, z] máximo) no sistema local do nó."""
+        # None quando a caixa não é conhecida, o que impede o descarte do nó
+        if self._bounds_dirty:
+            self._bounds = self.compute_bounds()
+            self._bounds_dirty = False
+        return self._bounds
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente do nó."""
+        return None
+
+    def changed(self):
+        """Invalida a caixa envolvente do nó e dos nós acima dele."""
+        node = self
+        while node is not None:
+            node._bounds_dirty = True
+            node = node.parent
+
 class X3DChildNode(X3DNode):
     """Nó abstrato como base para campos children, addChildren, and removeChildren."""
 
@@ -365,6 +515,10 @@ class X3DChildNode(X3DNode):
         """Parse do nó X3D."""
         super().__init__(node)  # Chama construtor da classe pai
 
+    def parent_bounds(self):
+        """Caixa envolvente do nó no sistema de coordenadas do pai."""
+        return self.bounds()
+
 
 class X3DBindableNode(X3DChildNode):
     """X3DBindableNode é o tipo base abstrato para certos tipos de objetos."""
@@ -425,6 +579,23 @@ class X3DGroupingNode(X3DChildNode):
         self.bboxSize = SFVec3f(node, "bboxSize", [-1, -1, -1])
         #   MFNode     [in]     addChildren               [X3DChildNode]
         #   MFNode     [in]     removeChildren            [X3DChildNode]
+        for child in self.children:
+            child.parent = self
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente do grupo no seu sistema local."""
+        # Usa o bboxCenter e bboxSize do arquivo se informados, senão une as caixas dos filhos
+        if min(self.bboxSize) >= 0:
+            return ([c - s/2 for c, s in zip(self.bboxCenter, self.bboxSize)],
+                    [c + s/2 for c, s in zip(self.bboxCenter, self.bboxSize)])
+
+        boxes = []
+        for child in self.children:
+            box = child.parent_bounds()
+            if box is None:
+                return None
+            boxes.append(box)
+        return merge_bounds(boxes)
 
 
 class Transform(X3DGroupingNode):
@@ -449,11 +620,28 @@ class Transform(X3DGroupingNode):
                                      scale=self.scale,
                                      rotation=self.rotation)
 
-        for child in self.children:
-            child.render()
+        # Pula os filhos se a caixa envolvente estiver fora do volume de visão
+        visible = True
+        box = self.bounds()
+        if box is not None and "Transform_visible" in X3D.renderer:
+            lower, upper = box
+            visible = X3D.renderer["Transform_visible"](
+                bboxCenter=[(lower[i] + upper[i]) / 2 for i in range(3)],
+                bboxSize=[upper[i] - lower[i] for i in range(3)])
+
+        if visible:
+            for child in self.children:
+                child.render()
 
         X3D.renderer["Transform_out"]()  # Tira a transformação da pilha
 
+    def parent_bounds(self):
+        """Caixa envolvente do nó no sistema de coordenadas do pai."""
+        box = self.bounds()
+        if box is None:
+            return None
+        return transform_bounds(box, self.translation, self.rotation, self.scale)
+
 
 # Shape component
 
@@ -465,6 +653,14 @@ class X3DShapeNode(X3DChildNode):
         super().__init__(node) # Chama construtor da classe pai
         self.appearance = SFNode(node, "X3DAppearanceNode", None)
         self.geometry = SFNode(node, "X3DGeometryNode", None)
+        if self.geometry:
+            self.geometry.parent = self
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente da geometria."""
+        if self.geometry:
+            return self.geometry.bounds()
+        return None
 
 class X3DAppearanceNode(X3DNode):
     """Este é o tipo de nó básico para todos os nós do tipo Appearance."""
@@ -603,6 +799,31 @@ class X3DComposedGeometryNode(X3DGeometryNode):
         self.colorPerVertex = SFBool(node, "colorPerVertex", True)
         self.normalPerVertex = SFBool(node, "normalPerVertex", True)
         self.solid = SFBool(node, "solid", True)
+        if self.coord:
+            self.coord.parent = self
+        self._normals = None  # normais em cache e os pontos e triângulos que as geraram
+        self._normals_source = None
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente dos pontos da geometria."""
+        if self.coord:
+            return point_bounds(self.coord.point)
+        return None
+
+    def crease_angle(self):
+        """Ângulo de suavização das normais geradas para nós sem o campo creaseAngle."""
+        # Com normalPerVertex as normais dos triângulos que dividem um vértice são somadas
+        return math.pi if self.normalPerVertex else 0.0
+
+    def normals(self, triangles, creaseAngle=0.0):
+        """Normais dos vértices dos triângulos, calculadas uma única vez por malha."""
+        # Refeitas só se os pontos ou os triângulos forem trocados (por exemplo por um ROUTE)
+        point = self.coord.point if self.coord else []
+        source = self._normals_source
+        if source is None or source[0] is not point or source[1] is not triangles:
+            self._normals = mesh_normals(point, triangles, creaseAngle)
+            self._normals_source = (point, triangles)
+        return self._normals
 
 
 class X3DGeometricPropertyNode(X3DNode):
@@ -666,7 +887,8 @@ class TriangleSet(X3DComposedGeometryNode):
         colors = get_colors(appearance)
         if self.coord and self.coord.point:
             # NO FUTURO MANDAR O OBJETO INTEIRO COM SEUS PARAMETROS ENCAPSULADOS
-            X3D.renderer["TriangleSet"](point=self.coord.point, colors=colors)
+            X3D.renderer["TriangleSet"](point=self.coord.point, colors=colors,
+                                        ccw=self.ccw, solid=self.solid)
 
 class TriangleStripSet(X3DComposedGeometryNode):
     """Representa uma forma 3D composta por faixas de triângulos."""
@@ -675,10 +897,20 @@ class TriangleStripSet(X3DComposedGeometryNode):
         """Parse do nó X3D."""
         super().__init__(node) # Chama construtor da classe pai
         self.stripCount = MFInt32(node, "stripCount", [])
+        self.compile()
 
         # Preview
         # Implemente se desejar
 
+    def compile(self):
+        """Converte as tiras em triângulos uma única vez, sem refazer isso a cada quadro."""
+        self.triangles = strip_triangles(self.stripCount)
+
+    def changed(self):
+        """Refaz os triângulos quando algum campo é alterado (por exemplo por um ROUTE)."""
+        self.compile()
+        super().changed()
+
     def render(self, appearance=None):
         """Rotina de renderização."""
         if "TriangleStripSet" not in X3D.renderer:
@@ -689,7 +921,11 @@ class TriangleStripSet(X3DComposedGeometryNode):
             # NO FUTURO MANDAR O OBJETO INTEIRO COM SEUS PARAMETROS ENCAPSULADOS
             X3D.renderer["TriangleStripSet"](point=self.coord.point,
                                              stripCount=self.stripCount,
-                                             colors=colors)
+                                             colors=colors,
+                                             ccw=self.ccw, solid=self.solid,
+                                             triangles=self.triangles,
+                                             normals=self.normals(self.triangles,
+                                                                  self.crease_angle()))
 
 class IndexedTriangleStripSet(X3DComposedGeometryNode):
     """Representa uma forma 3D composta de tiras de triângulos."""
@@ -698,10 +934,20 @@ class IndexedTriangleStripSet(X3DComposedGeometryNode):
         """Parse do nó X3D."""
         super().__init__(node) # Chama construtor da classe pai
         self.index = MFInt32(node, "index", [])
+        self.compile()
 
         # Preview
         # Implemente se desejar
 
+    def compile(self):
+        """Converte as tiras em triângulos uma única vez, sem refazer isso a cada quadro."""
+        self.triangles = indexed_strip_triangles(self.index)
+
+    def changed(self):
+        """Refaz os triângulos quando algum campo é alterado (por exemplo por um ROUTE)."""
+        self.compile()
+        super().changed()
+
     def render(self, appearance=None):
         """Rotina de renderização."""
         if "IndexedTriangleStripSet" not in X3D.renderer:
@@ -713,7 +959,11 @@ class IndexedTriangleStripSet(X3DComposedGeometryNode):
                 # NO FUTURO MANDAR O OBJETO INTEIRO COM SEUS PARAMETROS ENCAPSULADOS
                 X3D.renderer["IndexedTriangleStripSet"](point=self.coord.point,
                                                         index=self.index,
-                                                        colors=colors)
+                                                        colors=colors,
+                                                        ccw=self.ccw, solid=self.solid,
+                                                        triangles=self.triangles,
+                                                        normals=self.normals(self.triangles,
+                                                                             self.crease_angle()))
 
 
 # Geometry2D component
@@ -881,6 +1131,11 @@ class Box(X3DGeometryNode):
         """Parse do nó X3D."""
         super().__init__(node) # Chama construtor da classe pai
         self.size = SFVec3f(node, "size", [2, 2, 2])
+        self.solid = SFBool(node, "solid", True)
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente da geometria."""
+        return [-s/2 for s in self.size], [s/2 for s in self.size]
 
     def render(self, appearance=None):
         """Rotina de renderização."""
@@ -889,7 +1144,7 @@ class Box(X3DGeometryNode):
 
         colors = get_colors(appearance)
         if self.size:
-            X3D.renderer["Box"](size=self.size, colors=colors)
+            X3D.renderer["Box"](size=self.size, colors=colors, solid=self.solid)
 
 
 class Sphere(X3DGeometryNode):
@@ -899,6 +1154,11 @@ class Sphere(X3DGeometryNode):
         """Parse do nó X3D."""
         super().__init__(node) # Chama construtor da classe pai
         self.radius = SFFloat(node, "radius", 1)
+        self.solid = SFBool(node, "solid", True)
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente da geometria."""
+        return [-self.radius] * 3, [self.radius] * 3
 
     def render(self, appearance=None):
         """Rotina de renderização."""
@@ -907,7 +1167,7 @@ class Sphere(X3DGeometryNode):
 
         colors = get_colors(appearance)
         if self.radius:
-            X3D.renderer["Sphere"](radius=self.radius, colors=colors)
+            X3D.renderer["Sphere"](radius=self.radius, colors=colors, solid=self.solid)
 
 
 class Cone(X3DGeometryNode):
@@ -918,6 +1178,12 @@ class Cone(X3DGeometryNode):
         super().__init__(node) # Chama construtor da classe pai
         self.bottomRadius  = SFFloat(node, "bottomRadius", 1)
         self.height = SFFloat(node, "height", 2)
+        self.solid = SFBool(node, "solid", True)
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente da geometria."""
+        r, h = self.bottomRadius, self.height / 2
+        return [-r, -h, -r], [r, h, r]
 
     def render(self, appearance=None):
         """Rotina de renderização."""
@@ -926,7 +1192,8 @@ class Cone(X3DGeometryNode):
 
         colors = get_colors(appearance)
         if self.height and self.bottomRadius:
-            X3D.renderer["Cone"](bottomRadius=self.bottomRadius, height=self.height, colors=colors)
+            X3D.renderer["Cone"](bottomRadius=self.bottomRadius, height=self.height, colors=colors,
+                                 solid=self.solid)
 
 class Cylinder(X3DGeometryNode):
     """Classe responsável por geometria Cylinder, que é uma cilindro com centro no (0,0,0)."""
@@ -936,6 +1203,12 @@ class Cylinder(X3DGeometryNode):
         super().__init__(node) # Chama construtor da classe pai
         self.radius = SFFloat(node, "radius", 1)
         self.height = SFFloat(node, "height", 2)
+        self.solid = SFBool(node, "solid", True)
+
+    def compute_bounds(self):
+        """Calcula a caixa envolvente da geometria."""
+        r, h = self.radius, self.height / 2
+        return [-r, -h, -r], [r, h, r]
 
     def render(self, appearance=None):
         """Rotina de renderização."""
@@ -944,7 +1217,8 @@ class Cylinder(X3DGeometryNode):
 
         colors = get_colors(appearance)
         if self.radius and self.height:
-            X3D.renderer["Cylinder"](radius=self.radius, height=self.height, colors=colors)
+            X3D.renderer["Cylinder"](radius=self.radius, height=self.height, colors=colors,
+                                     solid=self.solid)
 
 class IndexedFaceSet(X3DComposedGeometryNode):
     """Classe responsável por geometria Indexed Face Set, que é uma malha de polígonos."""
@@ -956,6 +1230,34 @@ class IndexedFaceSet(X3DComposedGeometryNode):
         self.coordIndex = MFInt32(node, "coordIndex", [])
         self.colorIndex = MFInt32(node, "colorIndex", [])
         self.texCoordIndex = MFInt32(node, "texCoordIndex", [])
+        self.creaseAngle = SFFloat(node, "creaseAngle", 0)
+        self.compile()
+
+    @staticmethod
+    def triangulate(coordIndex, colorIndex=None, texCoordIndex=None):
+        """Índices (Numpy) dos vértices de cada triângulo em coord, color e texCoord."""
+        # colorIndex e texCoordIndex vazios usam coordIndex; None quando não forem usados
+        corners = fan_triangles(coordIndex)
+        triangles = {}
+        for name, index in (("coord", coordIndex), ("color", colorIndex),
+                            ("texCoord", texCoordIndex)):
+            if index is None:
+                triangles[name] = None
+            else:
+                triangles[name] = np.asarray(index or coordIndex, dtype=int)[corners]
+        return triangles
+
+    def compile(self):
+        """Triangula os polígonos uma única vez, sem precisar refazer isso a cada quadro."""
+        self.triangles = IndexedFaceSet.triangulate(
+            self.coordIndex,
+            self.colorIndex if self.color and self.colorPerVertex else None,
+            self.texCoordIndex if self.texCoord else None)
+
+    def changed(self):
+        """Refaz os triângulos quando algum campo é alterado (por exemplo por um ROUTE)."""
+        self.compile()
+        super().changed()
 
     def render(self, appearance=None):
         """Rotina de renderização."""
@@ -981,7 +1283,12 @@ class IndexedFaceSet(X3DComposedGeometryNode):
                                            colorIndex=self.colorIndex, texCoord=ret_texCoord,
                                            texCoordIndex=self.texCoordIndex,
                                            colors=colors,
-                                           current_texture=X3D.current_texture)
+                                           current_texture=X3D.current_texture,
+                                           ccw=self.ccw, solid=self.solid,
+                                           triangles=self.triangles,
+                                           normals=self.normals(
+                                               self.triangles["coord"],
+                                               self.creaseAngle if self.normalPerVertex else 0))
 
 
 # Lighting component
@@ -1011,6 +1318,9 @@ class DirectionalLight(X3DLightNode):
         if "DirectionalLight" not in X3D.renderer:
             raise Exception("DirectionalLight não foi implementado.")
 
+        if not self.on:  # luz apagada não ilumina a cena
+            return
+
         X3D.renderer["DirectionalLight"](ambientIntensity=self.ambientIntensity,
                                          color=self.color,
                                          intensity=self.intensity,
@@ -1024,16 +1334,23 @@ class PointLight(X3DLightNode):
         """Parse do nó X3D."""
         super().__init__(node) # Chama construtor da classe pai
         self.location = SFVec3f(node, "location", [0.0, 0.0, 0.0])
+        self.attenuation = SFVec3f(node, "attenuation", [1.0, 0.0, 0.0])
+        self.radius = SFFloat(node, "radius", 100)
 
     def render(self):
         """Rotina de renderização."""
         if "PointLight" not in X3D.renderer:
             raise Exception("PointLight não foi implementado.")
 
+        if not self.on:  # luz apagada não ilumina a cena
+            return
+
         X3D.renderer["PointLight"](ambientIntensity=self.ambientIntensity,
                                    color=self.color,
                                    intensity=self.intensity,
-                                   location=self.location)
+                                   location=self.location,
+                                   attenuation=self.attenuation,
+                                   radius=self.radius)
 
 
 # Texturing component
@@ -1071,7 +1388,7 @@ class X3DFogObject():
         self.fogType = SFString(node, "fogType", "LINEAR")
         self.visibilityRange = SFFloat(node, "visibilityRange", 0)
 
-class Fog(X3DBindableNode, X3DFogObject):
+class Fog(X3DFogObject, X3DBindableNode):
     """Simula efeitos atmosféricos combinando objetos com a cor especificada."""
 
     def __init__(self, node):
@@ -1084,7 +1401,7 @@ class Fog(X3DBindableNode, X3DFogObject):
             raise Exception("Fog não foi implementado.")
 
         X3D.renderer["Fog"](visibilityRange=self.visibilityRange,
-                            color=self.color)
+                            color=self.color, fogType=self.fogType)
 
 class X3DInterpolatorNode(X3DChildNode):
     """Base para todos os tipos de interpoladores."""
@@ -1149,3 +1466,4 @@ class ROUTE():
         value = getattr(fromNode, self.fromField)
         toNode = X3DNode.named_nodes[self.toNode]
         setattr(toNode, self.toField, value)
+        toNode.changed()  # caixas envolventes acima do nó precisam ser recalculadas